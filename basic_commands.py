@@ -1,17 +1,45 @@
-from courses import *
+import os
+import logging
+
+from aiogram import Bot
+from aiogram import types as aio_types
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
 import db
+import kaspi
+import tenants
+from courses import CourseRequestForm
+from registrations import registrations
+from paid_users import paid_users
+from metrics import metrics
+from roles import roles
+from media import media
 
 class PaymentState(StatesGroup):
     awaiting_payment = State()
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'courses.db')
+# Photo (path or URL) sent before the menu on /start; uploaded once, see media.py
+WELCOME_MEDIA = os.getenv("WELCOME_MEDIA")
+
+
+async def send_welcome_media(message: aio_types.Message, bot: Bot):
+    source = tenants.setting("WELCOME_MEDIA", WELCOME_MEDIA)
+    if not source:
+        return
+    try:
+        await media.send(bot, message.chat.id, source)
+    except Exception:
+        # The menu matters more than the picture
+        logging.exception("Could not send welcome media")
 
 
 async def start(message: aio_types.Message, state: FSMContext):
     user_id = message.from_user.id
-    print(user_id)
-    if db.record_payment(user_id):
+    if await db.record_payment(user_id):
         keyboard = [
             [InlineKeyboardButton(text="Курсы", callback_data="courses")],
             [InlineKeyboardButton(text="Эфиры", callback_data="lives")],
@@ -22,10 +50,10 @@ async def start(message: aio_types.Message, state: FSMContext):
             reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
         )
     else:
-        kb = [
-            [InlineKeyboardButton(text="Bank card", callback_data="bank")],
-            [InlineKeyboardButton(text="Kaspi", callback_data="kaspi")]
-        ]
+        kb = [[InlineKeyboardButton(text="Bank card", callback_data="bank")]]
+        # Hidden until this bot has a Kaspi recipient to check receipts against
+        if kaspi.enabled():
+            kb.append([InlineKeyboardButton(text="Kaspi", callback_data="kaspi")])
         await message.answer(
             text="Пожалуйста совершите оплату: \n Выберите способ оплаты",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
@@ -33,8 +61,20 @@ async def start(message: aio_types.Message, state: FSMContext):
         await state.set_state(PaymentState.awaiting_payment)
 
 async def handle_random_message(message: aio_types.Message, state: FSMContext):
-    db.save_new_user(message.from_user)
+    registrations.add(message.from_user)
     if message.forward_from_chat is not None:
-        print(message.forward_from_chat.id)
+        # Handy for finding a channel's id: forward any post from it to the bot
+        logging.info("Message forwarded from chat %s", message.forward_from_chat.id)
     await message.answer("Пожалуйста, напишите /start для начала работы.")
     await state.set_state(CourseRequestForm.waiting_for_course_request)
+
+async def stats(message: aio_types.Message):
+    if not await roles.is_admin(message.from_user.id):
+        return
+    index = paid_users.stats()
+    await message.answer(
+        "📊 Handlers\n" + (metrics.summary("bot_handler_seconds") or "—") +
+        "\n\n🗄 DB queries\n" + (metrics.summary("db_query_seconds") or "—") +
+        "\n\n📡 Bot API\n" + (metrics.summary("bot_api_seconds") or "—") +
+        f"\n\n💳 Paid index: {index['size']} users, {index['hits']} hits / {index['misses']} misses"
+    )
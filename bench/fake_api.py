@@ -0,0 +1,89 @@
+"""Local stand-in for the Telegram Bot API.
+
+Answers every ``/bot<token>/<method>`` call with a minimal valid result so the
+handlers can run without network access. Run it on its own with
+
+    python bench/fake_api.py --port 8081 --latency 0.02
+
+and point the bot at it with ``TELEGRAM_API_URL=http://127.0.0.1:8081``.
+"""
+import time
+import asyncio
+import argparse
+import itertools
+from collections import Counter
+
+from aiohttp import web
+
+# Methods answered with a Message object; everything else gets ``true``
+MESSAGE_METHODS = {
+    'sendmessage', 'editmessagetext', 'editmessagereplymarkup', 'sendinvoice',
+    'forwardmessage', 'sendphoto', 'senddocument', 'sendvideo',
+}
+MESSAGE_ID_METHODS = {'copymessage'}
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    def _chat_id(self, params) -> int:
+        try:
+            return int(params.get('chat_id', 1))
+        except ValueError:
+            return 1
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        self.calls[method] += 1
+        params = await request.post()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method in MESSAGE_METHODS:
+            chat_id = self._chat_id(params)
+            result = {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'channel'},
+                'text': params.get('text', ''),
+            }
+            if method == 'sendphoto':
+                # An upload ("attach://…") gets a new file_id, a file_id is echoed back
+                photo = str(params.get('photo', ''))
+                if photo.startswith('attach://'):
+                    self.calls['upload'] += 1
+                    photo = f"photo{result['message_id']}"
+                result['photo'] = [{'file_id': photo, 'file_unique_id': photo, 'width': 1, 'height': 1}]
+        elif method in MESSAGE_ID_METHODS:
+            result = {'message_id': next(self._message_ids)}
+        elif method == 'getme':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        return app
+
+
+async def start(host: str = '127.0.0.1', port: int = 8081, latency: float = 0.0):
+    api = FakeBotAPI(latency)
+    runner = web.AppRunner(api.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return api, runner
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every call')
+    args = parser.parse_args()
+    api = FakeBotAPI(args.latency)
+    web.run_app(api.app(), host=args.host, port=args.port)
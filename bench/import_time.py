@@ -0,0 +1,116 @@
+"""Cold-start benchmark: how long ``import main`` takes.
+
+Imports the bot in fresh interpreters with ``-X importtime`` against a
+throwaway database, reports the median wall time, the slowest modules and
+the migration check, and fails if a heavy optional library gets imported
+eagerly again.
+
+    python bench/import_time.py --runs 5 --max-ms 1500
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import statistics
+from collections import defaultdict
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Must only be imported when first used
+LAZY_MODULES = ('telethon', 'pytesseract', 'PIL', 'pdf2image')
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+import db, sqlite3, migrations
+conn = db.get_db_connection()
+t = time.perf_counter()
+migrations.migrate(conn)
+migrate = time.perf_counter() - t
+print(json.dumps({
+    'import': elapsed,
+    'migrate': migrate,
+    'eager': [m for m in %r if m in sys.modules],
+}))
+""" % (LAZY_MODULES,)
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Self time per top-level package, in microseconds."""
+    totals = defaultdict(int)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            self_us = int(parts[0])
+        except ValueError:
+            continue  # header line
+        totals[parts[2].strip().split(".")[0]] += self_us
+    return totals
+
+
+def run_once(db_path: str) -> tuple:
+    env = dict(os.environ)
+    env.setdefault("TELEGRAM_BOT_TOKEN", "123456:BENCH")
+    env.setdefault("PROVIDER_TOKEN", "1:TEST:bench")
+    env["DB_PATH"] = db_path
+    env["METRICS_PORT"] = "0"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=BASE_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="slowest packages to list")
+    parser.add_argument("--max-ms", type=float, default=0, help="fail if the median import exceeds this")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        # The first run creates the schema and warms the bytecode cache
+        run_once(db_path)
+        samples, packages = [], defaultdict(list)
+        for _ in range(args.runs):
+            sample, totals = run_once(db_path)
+            samples.append(sample)
+            for name, us in totals.items():
+                packages[name].append(us)
+
+    import_ms = statistics.median(s['import'] for s in samples) * 1000
+    migrate_ms = statistics.median(s['migrate'] for s in samples) * 1000
+    eager = sorted({m for s in samples for m in s['eager']})
+    slowest = sorted(((statistics.median(v) / 1000, k) for k, v in packages.items()), reverse=True)[:args.top]
+
+    print(f"import main: {import_ms:.0f} ms (median of {args.runs})")
+    print(f"migrate on a warm database: {migrate_ms:.2f} ms")
+    print("slowest packages (self time):")
+    for ms, name in slowest:
+        print(f"  {name:<24} {ms:8.1f} ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({'import_ms': import_ms, 'migrate_ms': migrate_ms, 'eager': eager,
+                       'packages': {name: ms for ms, name in slowest}}, f, indent=2)
+
+    failed = False
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+    if args.max_ms and import_ms > args.max_ms:
+        print(f"FAIL: import took {import_ms:.0f} ms, limit is {args.max_ms:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
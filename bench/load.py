@@ -0,0 +1,201 @@
+"""End-to-end load benchmark for the bot handlers.
+
+Starts the fake Bot API server from ``fake_api.py``, points the bot at it and
+at a throwaway SQLite database, then replays a synthetic stream of /start,
+course browsing, support, random-message and successful-payment updates
+through the dispatcher. Reports handler latency percentiles, updates/sec,
+DB query counts and Bot API calls.
+
+    python bench/load.py --scenarios 2000 --concurrency 50
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import itertools
+from collections import defaultdict
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+import fake_api
+
+SCENARIOS = {
+    'start': 40,
+    'browse': 30,
+    'random': 15,
+    'support': 10,
+    'payment': 5,
+}
+
+
+def percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class UpdateFactory:
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+
+    def _chat(self, user_id: int) -> dict:
+        return {'id': user_id, 'type': 'private'}
+
+    def message(self, user_id: int, text: str = None, **extra) -> dict:
+        update_id = next(self._ids)
+        message = {'message_id': update_id, 'date': int(time.time()),
+                   'chat': self._chat(user_id), 'from': self._user(user_id), **extra}
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': update_id, 'message': message}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        update_id = next(self._ids)
+        return {'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'from': self._user(user_id), 'chat_instance': 'bench', 'data': data,
+            'message': {'message_id': update_id, 'date': int(time.time()),
+                        'chat': self._chat(user_id), 'text': 'menu'},
+        }}
+
+    def scenario(self, kind: str, user_id: int, courses):
+        if kind == 'start':
+            return [('start', self.message(user_id, '/start'))]
+        if kind == 'browse':
+            return [('courses', self.callback(user_id, 'courses')),
+                    ('course', self.callback(user_id, random.choice(courses)))]
+        if kind == 'support':
+            return [('support', self.callback(user_id, 'support')),
+                    ('support_message', self.message(user_id, 'Помогите, пожалуйста'))]
+        if kind == 'payment':
+            n = next(self._ids)
+            return [('payment', self.message(user_id, successful_payment={
+                'currency': 'KZT', 'total_amount': 100000, 'invoice_payload': 'test-invoice-payload',
+                'telegram_payment_charge_id': f'bench-{n}', 'provider_payment_charge_id': f'bench-{n}',
+            }))]
+        return [('random', self.message(user_id, 'hello'))]
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    os.environ['DB_PATH'] = os.path.join(workdir, 'bench.db')
+    os.environ['TELEGRAM_API_URL'] = f'http://127.0.0.1:{args.port}'
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:BENCHMARK')
+    os.environ.setdefault('PROVIDER_TOKEN', '1:TEST:bench')
+    # The fake API has no flood limits; pass 30 to see Telegram's global cap
+    os.environ['OUTBOUND_RATE'] = str(args.outbound_rate)
+
+    # Imported late so db.py and main.py pick up the environment above
+    import main
+    import db
+    from aiogram.types import Update
+    from callbacks import CourseCallback
+    logging.getLogger('aiogram').setLevel(logging.WARNING)
+
+    paid = random.sample(range(1, args.users + 1), int(args.users * args.paid_ratio))
+    # Loaded into the paid-user index by on_startup
+    await db.record_ledger_entries([
+        (f"bench-seed-{user_id}", None, user_id, 0, "KZT", 30, "bench") for user_id in paid
+    ])
+
+    api, runner = await fake_api.start(port=args.port, latency=args.latency)
+    await main.on_startup()
+    # Packed callback_data of every course button
+    courses = [CourseCallback(id=course_id).pack() for course_id, _, _, _ in await db.load_courses()]
+
+    factory = UpdateFactory()
+    kinds, weights = zip(*SCENARIOS.items())
+    scenarios = [
+        factory.scenario(kind, random.randint(1, args.users), courses)
+        for kind in random.choices(kinds, weights, k=args.scenarios)
+    ]
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def play(steps):
+        async with semaphore:
+            for label, raw in steps:
+                update = Update.model_validate(raw, context={'bot': main.bot})
+                started = time.perf_counter()
+                try:
+                    await main.dp.feed_update(main.bot, update)
+                except Exception:
+                    errors[label] += 1
+                latencies[label].append(time.perf_counter() - started)
+
+    queries_before = db.pool.queries
+    started = time.perf_counter()
+    await asyncio.gather(*(play(steps) for steps in scenarios))
+    elapsed = time.perf_counter() - started
+    queries = db.pool.queries - queries_before
+
+    await main.on_shutdown()
+    await main.bot.session.close()
+    await runner.cleanup()
+
+    total = sum(len(v) for v in latencies.values())
+    report = {
+        'updates': total,
+        'seconds': round(elapsed, 3),
+        'updates_per_sec': round(total / elapsed, 1),
+        'db_queries': queries,
+        'db_queries_per_update': round(queries / total, 3) if total else 0,
+        'api_calls': dict(api.calls),
+        'errors': dict(errors),
+        'latency_ms': {},
+    }
+    for label, values in sorted(latencies.items()) + [('all', [v for vs in latencies.values() for v in vs])]:
+        values.sort()
+        report['latency_ms'][label] = {
+            'n': len(values),
+            'p50': round(percentile(values, 50) * 1000, 2),
+            'p95': round(percentile(values, 95) * 1000, 2),
+            'p99': round(percentile(values, 99) * 1000, 2),
+        }
+    return report
+
+
+def print_report(report: dict):
+    print(f"{report['updates']} updates in {report['seconds']} s "
+          f"({report['updates_per_sec']} updates/s)")
+    print(f"DB queries: {report['db_queries']} ({report['db_queries_per_update']} per update)")
+    print(f"Bot API calls: {report['api_calls']}")
+    if report['errors']:
+        print(f"Errors: {report['errors']}")
+    print(f"{'handler':<16}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, stats in report['latency_ms'].items():
+        print(f"{label:<16}{stats['n']:>7}{stats['p50']:>10}{stats['p95']:>10}{stats['p99']:>10}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--paid-ratio', type=float, default=0.5)
+    parser.add_argument('--latency', type=float, default=0.0, help='fake Bot API latency in seconds')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--outbound-rate', type=float, default=100000, help='global Bot API sends per second')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
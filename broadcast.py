@@ -0,0 +1,139 @@
+import os
+import time
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+
+import db
+from outbound import BULK, priority
+
+# Rate limits and flood waits are handled by the outbound scheduler
+CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 10))
+PAGE_SIZE = 200
+MAX_ATTEMPTS = 5
+
+
+class _Progress:
+    """Records delivery results as sends complete.
+
+    One write runs at a time and takes every result that arrived while the
+    previous one was running, so a stop loses at most the batch in flight.
+    """
+
+    def __init__(self, broadcast_id: int):
+        self.broadcast_id = broadcast_id
+        self._results = []
+        self._wake = asyncio.Event()
+        self._closing = False
+        self._task = asyncio.create_task(self._write())
+
+    def add(self, result):
+        self._results.append(result)
+        self._wake.set()
+
+    async def _write(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            batch, self._results = self._results, []
+            if batch:
+                await db.mark_broadcast_targets(self.broadcast_id, batch)
+            if self._closing and not self._results:
+                return
+
+    async def close(self):
+        """Write out what is left; also runs when the broadcast is cancelled."""
+        self._closing = True
+        self._wake.set()
+        await asyncio.shield(self._task)
+
+
+class BroadcastEngine:
+    """Copies one message into many chats as bulk traffic.
+
+    Calls go out at ``BULK`` priority, so the outbound scheduler paces them
+    under Telegram's limits behind payments and replies to users. Every
+    target is stored in ``broadcast_targets`` and marked as it is delivered,
+    so an interrupted broadcast resumes where it stopped.
+    """
+
+    def __init__(self):
+        self._tasks = set()
+
+    async def _deliver(self, bot: Bot, semaphore: asyncio.Semaphore, progress: _Progress, chat_id: int,
+                       from_chat_id: int, message_id: int):
+        async with semaphore:
+            progress.add(await self._send(bot, chat_id, from_chat_id, message_id))
+
+    async def _send(self, bot: Bot, chat_id: int, from_chat_id: int, message_id: int):
+        for _ in range(MAX_ATTEMPTS):
+            try:
+                with priority(BULK):
+                    await bot.copy_message(chat_id=chat_id, from_chat_id=from_chat_id, message_id=message_id)
+                return chat_id, 'sent', None
+            except TelegramRetryAfter:
+                # The scheduler has paused all sends; try again once it resumes
+                continue
+            except TelegramAPIError as e:
+                return chat_id, 'failed', e.message
+        return chat_id, 'failed', 'retry limit reached'
+
+    async def run(self, bot: Bot, broadcast_id: int, from_chat_id: int, message_id: int, admin_chat_id: int):
+        started = time.monotonic()
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+        progress = _Progress(broadcast_id)
+        after = None
+        try:
+            while True:
+                chat_ids = await db.load_broadcast_targets(broadcast_id, after, PAGE_SIZE)
+                if not chat_ids:
+                    break
+                after = chat_ids[-1]
+                await asyncio.gather(*(
+                    self._deliver(bot, semaphore, progress, chat_id, from_chat_id, message_id)
+                    for chat_id in chat_ids
+                ))
+        finally:
+            await progress.close()
+
+        counts = await db.finish_broadcast(broadcast_id)
+        elapsed = time.monotonic() - started
+        sent, failed = counts.get('sent', 0), counts.get('failed', 0)
+        await bot.send_message(
+            admin_chat_id,
+            f"📣 Рассылка #{broadcast_id} завершена\n"
+            f"Доставлено: {sent}\nОшибок: {failed}\n"
+            f"Время: {elapsed:.1f} с ({sent / elapsed if elapsed else 0:.1f} сообщ./с)"
+        )
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(_log_failure)
+
+    async def start(self, bot: Bot, from_chat_id: int, message_id: int, admin_chat_id: int,
+                    chat_ids, include_paid: bool) -> int:
+        broadcast_id = await db.create_broadcast(from_chat_id, message_id, admin_chat_id, chat_ids, include_paid)
+        self._spawn(self.run(bot, broadcast_id, from_chat_id, message_id, admin_chat_id))
+        return broadcast_id
+
+    async def resume(self, bot: Bot):
+        for broadcast_id, from_chat_id, message_id, admin_chat_id in await db.load_unfinished_broadcasts():
+            self._spawn(self.run(bot, broadcast_id, from_chat_id, message_id, admin_chat_id))
+
+    async def stop(self):
+        # Unsent targets stay 'pending' and are picked up by resume()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def _log_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logging.error("Broadcast failed", exc_info=task.exception())
+
+
+broadcasts = BroadcastEngine()
@@ -0,0 +1,78 @@
+import time
+
+from aiogram import types as aio_types
+from aiogram.filters.callback_data import CallbackData
+from aiogram.fsm.context import FSMContext
+
+import logs
+from metrics import metrics
+
+
+# --- Callback data ---
+# Courses are referenced by integer id so callback_data stays well under
+# Telegram's 64-byte limit whatever the course is called.
+class CourseCallback(CallbackData, prefix="c"):
+    id: int
+
+
+class CoursePageCallback(CallbackData, prefix="cp"):
+    # Keyset cursor: the page after (forward) or before this course id
+    anchor: int
+    forward: bool
+
+
+class PostTargetCallback(CallbackData, prefix="pt"):
+    # course id, or one of "all", "paid", "done"
+    target: str
+
+
+# --- Router ---
+class CallbackRouter:
+    """Dispatches callback queries through a dict keyed by callback_data prefix
+    and FSM state, instead of testing every registered filter in turn.
+
+    Handlers are called as ``handler(query, state, data)`` where ``data`` is the
+    unpacked ``CallbackData`` for typed routes, or the text after the first
+    ``:`` otherwise.
+    """
+
+    def __init__(self):
+        # prefix -> {state name or None: (handler, CallbackData class or None)}
+        self._routes = {}
+
+    def route(self, prefix, state=None):
+        callback_type = None
+        if isinstance(prefix, type) and issubclass(prefix, CallbackData):
+            callback_type, prefix = prefix, prefix.__prefix__
+        state_name = state.state if state is not None else None
+
+        def decorator(handler):
+            self._routes.setdefault(prefix, {})[state_name] = (handler, callback_type)
+            return handler
+        return decorator
+
+    async def dispatch(self, query: aio_types.CallbackQuery, state: FSMContext):
+        prefix, _, arg = (query.data or "").partition(':')
+        by_state = self._routes.get(prefix)
+        entry = None
+        if by_state:
+            if len(by_state) == 1 and None in by_state:
+                # No state filter on this prefix, skip the storage read
+                entry = by_state[None]
+            else:
+                entry = by_state.get(await state.get_state()) or by_state.get(None)
+        if entry is None:
+            # Stale button or a state that no longer applies (already answered, see user_locks.py)
+            return
+
+        handler, callback_type = entry
+        data = callback_type.unpack(query.data) if callback_type else arg
+        logs.annotate(handler=handler.__name__)
+        started = time.perf_counter()
+        try:
+            return await handler(query, state, data)
+        finally:
+            metrics.observe("bot_handler_seconds", handler.__name__, time.perf_counter() - started)
+
+
+router = CallbackRouter()
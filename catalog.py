@@ -0,0 +1,122 @@
+import os
+from collections import OrderedDict
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+import db
+from callbacks import CourseCallback, CoursePageCallback
+from tenants import TenantLocal
+
+PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", 10))
+# Pages and course keyboards kept in memory between catalog changes
+CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", 256))
+
+BACK_BUTTON = InlineKeyboardButton(text="Назад", callback_data="back")
+
+
+class CatalogPage:
+    """One keyset page of ``courses`` with its browsing keyboard."""
+
+    def __init__(self, rows, has_prev: bool, has_next: bool):
+        # [(id, name, url, channel_id)] in id order
+        self.rows = rows
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.markup = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=name, callback_data=CourseCallback(id=course_id).pack())]
+            for course_id, name, _, _ in rows
+        ] + self.nav_rows() + [[BACK_BUTTON]])
+
+    @property
+    def anchor(self):
+        """(anchor, forward) that renders this page again."""
+        return (self.rows[0][0] - 1, True) if self.rows else (0, True)
+
+    def nav_rows(self) -> list:
+        nav = []
+        if self.has_prev:
+            nav.append(InlineKeyboardButton(
+                text="⬅️", callback_data=CoursePageCallback(anchor=self.rows[0][0], forward=False).pack()
+            ))
+        if self.has_next:
+            nav.append(InlineKeyboardButton(
+                text="➡️", callback_data=CoursePageCallback(anchor=self.rows[-1][0], forward=True).pack()
+            ))
+        return [nav] if nav else []
+
+
+class CourseCatalog:
+    """Pages through ``courses`` by id instead of loading the whole table.
+
+    Pages and per-course keyboards are cached in small LRUs which are dropped
+    whenever ``db.courses_version`` moves, so browsing costs one indexed query
+    per page the first time and nothing after.
+    """
+
+    def __init__(self, page_size: int = PAGE_SIZE, cache_size: int = CACHE_SIZE):
+        self.page_size = page_size
+        self.cache_size = cache_size
+        self._version = None
+        self._pages = OrderedDict()
+        self._courses = OrderedDict()
+
+    def _cached(self, cache: OrderedDict, key):
+        if self._version != db.courses_version:
+            self._version = db.courses_version
+            self._pages.clear()
+            self._courses.clear()
+            return None
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+    def _store(self, cache: OrderedDict, key, value):
+        cache[key] = value
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    async def _load_page(self, anchor: int, forward: bool) -> CatalogPage:
+        rows = await db.load_courses_page(anchor, forward, self.page_size)
+        more = len(rows) > self.page_size
+        if forward:
+            if not rows and anchor > 0:
+                # Ran past the end (courses removed since); start over
+                return await self._load_page(0, True)
+            return CatalogPage(rows[:self.page_size], anchor > 0, more)
+        if not more:
+            # Reached the start: show a full first page rather than a short one
+            return await self._load_page(0, True)
+        return CatalogPage(rows[1:], True, True)
+
+    async def page(self, anchor: int = 0, forward: bool = True) -> CatalogPage:
+        version = db.courses_version
+        key = (anchor, forward)
+        page = self._cached(self._pages, key)
+        if page is None:
+            page = await self._load_page(anchor, forward)
+            # Don't cache a page that a concurrent write may have made stale
+            if version == db.courses_version:
+                self._store(self._pages, key, page)
+        return page
+
+    async def course(self, course_id: int):
+        """(name, url, channel_id, markup) of one course, or None if it is gone."""
+        version = db.courses_version
+        course = self._cached(self._courses, course_id)
+        if course is None:
+            row = await db.load_course(course_id)
+            if row is None:
+                return None
+            name, url, channel_id = row
+            markup = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text=f"Присоединяйтесь к {name}", url=url)],
+                [BACK_BUTTON]
+            ])
+            course = (name, url, channel_id, markup)
+            if version == db.courses_version:
+                self._store(self._courses, course_id, course)
+        return course
+
+
+catalog = TenantLocal(CourseCatalog)
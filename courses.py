@@ -7,10 +7,14 @@ from aiogram import types as aio_types
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from telethon import TelegramClient, functions
-from telethon import types as tele_types
 from dotenv import load_dotenv
 import db
+from mtproto import mtproto
+from catalog import catalog
+from roles import roles
+from broadcast import broadcasts
+from callbacks import CourseCallback, CoursePageCallback, PostTargetCallback
+from paid_users import paid_users
 
 # --- Load environment variables from .env ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -20,9 +24,6 @@ load_dotenv(os.path.join(BASE_DIR, '.env'))
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 CURATOR_CHAT_ID = int(os.getenv("CURATOR_CHAT_ID", 0))
 DB_PATH = os.path.join(BASE_DIR, 'courses.db')
-API_ID = os.getenv("APP-API-ID")
-API_HASH = os.getenv("APP-API-HASH")
-bot_username = "devstage_chatbot"
 
 class ChannelCreateState(StatesGroup):
     waiting_for_discription = State()
@@ -40,36 +41,64 @@ class ButtonStates(StatesGroup):
 
 
 
-async def courses_handler(query: aio_types.CallbackQuery, state: FSMContext):
-    courses = db.load_courses_url()
-    kb = [[InlineKeyboardButton(text=c, callback_data=f"course:{c}")] for c in courses]
-    kb.append([InlineKeyboardButton(text="Назад", callback_data="back")])
+# Inline search answers at most this many courses (Telegram allows 50)
+SEARCH_LIMIT = 20
+
+
+async def courses_handler(query: aio_types.CallbackQuery, state: FSMContext, anchor: int = 0, forward: bool = True):
+    page = await catalog.page(anchor, forward)
     await query.message.edit_text(
         "Выберите курс:",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=kb)
+        reply_markup=page.markup
     )
     await state.clear()
     await state.set_state(ButtonStates.main_page)
-    await query.answer()
 
-async def course_selection_handler(query: aio_types.CallbackQuery, state: FSMContext):
-    course = query.data.split(':', 1)[1]
+async def course_selection_handler(query: aio_types.CallbackQuery, state: FSMContext, callback_data: CourseCallback):
     user_id = query.from_user.id
-    courses = db.load_courses_url()
+    course = await catalog.course(callback_data.id)
+    if course is None:
+        # Course was removed since the menu was rendered
+        return await courses_handler(query, state)
+    markup = course[3]
 
-    kb = [
-        [InlineKeyboardButton(text= f"Присоединяйтесь к {course}", url= courses[course])],
-        [InlineKeyboardButton(text="Назад", callback_data="back")]
-        ]
     await query.message.edit_text(
         text= "Выберите курс который хотите пройти",
-        reply_markup= InlineKeyboardMarkup(inline_keyboard=kb))
+        reply_markup= markup)
     await state.clear()
     await state.set_state(ButtonStates.courses_page)
-    await query.answer()
+
+async def course_page_handler(query: aio_types.CallbackQuery, state: FSMContext, callback_data: CoursePageCallback):
+    return await courses_handler(query, state, callback_data.anchor, callback_data.forward)
+
+async def course_search_handler(inline_query: aio_types.InlineQuery):
+    # Course links are for subscribers only
+    if not paid_users.contains(inline_query.from_user.id, count=False):
+        await inline_query.answer(
+            [], cache_time=60, is_personal=True,
+            button=aio_types.InlineQueryResultsButton(text="Оформить подписку", start_parameter="pay")
+        )
+        return
+    text = inline_query.query.strip()
+    if text:
+        rows = await db.search_courses(text, SEARCH_LIMIT)
+    else:
+        rows = (await catalog.page()).rows
+    results = [
+        aio_types.InlineQueryResultArticle(
+            id=str(course_id),
+            title=name,
+            input_message_content=aio_types.InputTextMessageContent(message_text=f"📚 {name}"),
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text=f"Присоединяйтесь к {name}", url=url)]
+            ])
+        )
+        for course_id, name, url, _ in rows
+    ]
+    await inline_query.answer(results, cache_time=60, is_personal=True)
 
 async def add_course_handler(message: aio_types.Message, state: FSMContext):
-    if db.not_admin(message.from_user.id):
+    if not await roles.is_admin(message.from_user.id):
         return
     parts = message.text.split()
 
@@ -88,46 +117,62 @@ async def create_channel_handler(message: aio_types.Message, state: FSMContext):
     data = await state.get_data()
     course_name = data['course_name']
     description = message.text.strip()
+    await state.clear()
+    # The bot that will administer the channel is whichever one was asked
+    bot_username = (await message.bot.me()).username
 
-    channel_id, channel_link = await create_channel(course_name, description)
+    async def progress(text: str):
+        await message.answer(text)
 
-    if db.add_course_to_db(course_name, channel_link, str(channel_id)):
+    try:
+        channel_id, channel_link = await mtproto.submit(
+            lambda manager, report: create_channel(manager, report, course_name, description, bot_username),
+            progress
+        )
+    except asyncio.QueueFull:
+        await message.reply("🚫 Слишком много задач в очереди, попробуйте позже.")
+        return
+    except Exception as e:
+        await message.reply(f"🚫 Не удалось создать канал: {e}")
+        return
+
+    if await db.add_course_to_db(course_name, channel_link, str(channel_id)):
         await message.reply(f"✅ Курс «{course_name}» добавлен с ссылкой:\n{channel_link} \n ID канала курса {channel_id}")
     else:
         await message.reply("🚫 Такой курс или URL уже есть.")
 
-    await state.clear()
-
-async def create_channel(channel_name: str, channel_discript: str):
-    client = TelegramClient(session= 'session', api_id= int(API_ID), api_hash= API_HASH)
-    await client.start()
+async def create_channel(manager, progress, channel_name: str, channel_discript: str, bot_username: str):
+    # Telethon is heavy to import and only needed here
+    from telethon import functions
+    from telethon import types as tele_types
 
-
-    result_chan = await client(functions.channels.CreateChannelRequest(
+    await progress("⚙️ Создаю канал…")
+    result_chan = await manager.call(functions.channels.CreateChannelRequest(
         title= channel_name,
         about= channel_discript,
         broadcast=True,  # this makes it a channel, not a group
         megagroup=False  # False → regular channel (private by default)
-    ))
+    ), progress)
     channel = result_chan.chats[0]
 
-
-    result_grp = await client(functions.channels.CreateChannelRequest(
+    await progress("⚙️ Создаю группу обсуждения…")
+    result_grp = await manager.call(functions.channels.CreateChannelRequest(
         title=f'Discussion: {channel_name}',
         about=f'Discussion of posts in {channel_name}',
         broadcast=False,  # False + megagroup=True → supergroup
         megagroup=True
-    ))
+    ), progress)
     discussion = result_grp.chats[0]
 
-    await client(functions.channels.SetDiscussionGroupRequest(
+    await manager.call(functions.channels.SetDiscussionGroupRequest(
         broadcast=channel,  # the channel you created
         group=discussion  # the supergroup you created
-    ))
-
+    ), progress)
 
+    await progress("⚙️ Назначаю бота администратором…")
+    client = await manager.client()
     bot_entity = await client.get_entity(bot_username)
-    await client(functions.channels.EditAdminRequest(
+    await manager.call(functions.channels.EditAdminRequest(
         channel= channel,
         user_id= bot_entity,
         admin_rights=tele_types.ChatAdminRights(
@@ -141,13 +186,12 @@ async def create_channel(channel_name: str, channel_discript: str):
             add_admins=True
         ),
         rank="Channel Manager"  # optional label
-    ))
+    ), progress)
 
-    invite = await client(functions.messages.ExportChatInviteRequest(
+    invite = await manager.call(functions.messages.ExportChatInviteRequest(
         peer=channel
-    ))
+    ), progress)
     invite_link = invite.link
-    await client.disconnect()
     #
     # print('✅ Channel ID:', channel.id)
     # print('✅ Discussion ID:', discussion.id)
@@ -156,10 +200,10 @@ async def create_channel(channel_name: str, channel_discript: str):
 
 
 async def rename_course_handler(message: aio_types.Message):
-    if db.not_admin(message.from_user.id):
+    if not await roles.is_admin(message.from_user.id):
         return
     args = message.get_args().split(';')
-    if len(args) == 2 and db.rename_course_in_db(args[0].strip(), args[1].strip()):
+    if len(args) == 2 and await db.rename_course_in_db(args[0].strip(), args[1].strip()):
         await message.answer(
             f"Курс '{args[0].strip()}' переименован в '{args[1].strip()}'."
         )
@@ -167,39 +211,85 @@ async def rename_course_handler(message: aio_types.Message):
         await message.answer("Использование: /renamecourse старое;новое")
 
 
+def post_targets_markup(page, targets: list, paid: bool, all_courses: bool) -> InlineKeyboardMarkup:
+    def mark(selected: bool, text: str) -> str:
+        return f"✅ {text}" if selected else text
+
+    def button(text: str, target) -> list:
+        return [InlineKeyboardButton(text=text, callback_data=PostTargetCallback(target=str(target)).pack())]
+
+    keyboard = [button(mark(all_courses or course_id in targets, name), course_id) for course_id, name, _, _ in page.rows]
+    keyboard += page.nav_rows()
+    keyboard.append(button(mark(all_courses, "Все каналы"), "all"))
+    keyboard.append(button(mark(paid, "Оплатившие пользователи"), "paid"))
+    keyboard.append(button("Готово ➡️", "done"))
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
 async def create_post(message: aio_types.Message, state: FSMContext):
-    if db.not_admin(message.from_user.id):
+    if not await roles.is_admin(message.from_user.id):
         return
-    courses = db.load_courses_id()
-
-    keyboard = [[InlineKeyboardButton(text=course, callback_data=f"course_id:{courses[course]}")] for course in courses]
+    page = await catalog.page()
 
     await message.answer(
-        "📚 Select the course channel to post into:",
-        reply_markup= InlineKeyboardMarkup(inline_keyboard= keyboard)
+        "📚 Select the course channels (and/or paid users) to post into:",
+        reply_markup= post_targets_markup(page, [], False, False)
     )
 
     await state.set_state(PostStates.choosing_course)
+    await state.set_data({'targets': [], 'paid': False, 'all': False, 'page': page.anchor})
+
+async def course_choice_handler(callback: aio_types.CallbackQuery, state: FSMContext, callback_data: PostTargetCallback):
+    choice = callback_data.target
+    data = await state.get_data()
+    targets, paid, all_courses = data.get('targets', []), data.get('paid', False), data.get('all', False)
+
+    if choice == 'done':
+        if not targets and not paid and not all_courses:
+            # The query itself is already answered, see user_locks.py
+            await callback.message.answer("Выберите хотя бы один канал")
+            return
+        await callback.message.answer(
+            "✍️ Great! Now send me the message (text/photo/video/etc.) you want to post."
+        )
+        await state.set_state(PostStates.waiting_for_content)
+        return
+
+    if choice == 'all':
+        all_courses = not all_courses
+    elif choice == 'paid':
+        paid = not paid
+    elif int(choice) in targets:
+        targets.remove(int(choice))
+    else:
+        targets.append(int(choice))
 
-async def course_choice_handler(callback: aio_types.CallbackQuery, state: FSMContext):
-     _, channel_id = callback.data.split(':', 1)
+    await state.update_data(targets=targets, paid=paid, all=all_courses)
+    page = await catalog.page(*data.get('page', (0, True)))
+    await callback.message.edit_reply_markup(
+        reply_markup=post_targets_markup(page, targets, paid, all_courses)
+    )
 
-     await callback.message.answer(
-         "✍️ Great! Now send me the message (text/photo/video/etc.) you want to post."
-     )
-     await state.clear()
-     await state.set_state(PostStates.waiting_for_content)
-     await state.update_data(target_channel_id= int(channel_id))
+async def post_targets_page_handler(callback: aio_types.CallbackQuery, state: FSMContext, callback_data: CoursePageCallback):
+    data = await state.get_data()
+    page = await catalog.page(callback_data.anchor, callback_data.forward)
+    await state.update_data(page=page.anchor)
+    await callback.message.edit_reply_markup(
+        reply_markup=post_targets_markup(page, data.get('targets', []), data.get('paid', False), data.get('all', False))
+    )
 
 async def post_content_handler(message: aio_types.Message, state: FSMContext, bot: Bot):
     data = await state.get_data()
-    channel_id = data['target_channel_id']
+    await state.clear()
+    targets = None if data.get('all') else data.get('targets', [])
+    channels = await db.load_course_channels(targets) if targets != [] else []
 
-    await bot.copy_message(
-        chat_id= channel_id,
+    broadcast_id = await broadcasts.start(
+        bot,
         from_chat_id= message.chat.id,
-        message_id= message.message_id
+        message_id= message.message_id,
+        admin_chat_id= message.chat.id,
+        chat_ids= [int(channel_id) for channel_id in channels],
+        include_paid= data.get('paid', False)
     )
 
-    await message.answer("✅ Your post has been published!")
-    await state.clear()
+    await message.answer(f"✅ Рассылка #{broadcast_id} запущена, отчёт придёт по завершении.")
@@ -1,161 +1,630 @@
 import os
+import re
+import time
 import sqlite3
-from aiogram import types as aio_types
-from aiogram.types import user
+from array import array
+
+import migrations
+import tenants
+from db_pool import ConnectionPool, PRAGMAS
+from paid_users import paid_users
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, 'courses.db')
+DB_PATH = os.getenv("DB_PATH", os.path.join(BASE_DIR, 'courses.db'))
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 4))
 
 # --- Database Setup ---
 def get_db_connection():
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
     return conn
 
-with get_db_connection() as conn:
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS courses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            url TEXT UNIQUE NOT NULL,
-            channel_id TEXT NOT NULL DEFAULT '-1002519961960'
-        )
+pool = ConnectionPool(DB_PATH, size=DB_POOL_SIZE)
+# In multi-tenant mode every query goes to the current tenant's database
+pool.route = tenants.db_path
+
+# Schema lives in migrations.py; on an up-to-date database this is one SELECT
+_conn = get_db_connection()
+try:
+    migrations.migrate(_conn)
+finally:
+    _conn.close()
+
+# --- Helpers ---
+# Every helper has a blocking ``_name(conn, ...)`` body and an async wrapper that
+# runs it on the connection pool, so handlers never block the event loop.
+
+# Bumped after every write to ``courses`` so in-process caches know to reload.
+courses_version = 0
+
+def _bump_courses_version():
+    global courses_version
+    courses_version += 1
+
+def _load_courses(conn):
+    return [tuple(row) for row in conn.execute("SELECT id, name, url, channel_id FROM courses ORDER BY id")]
+
+async def load_courses():
+    return await pool.run(_load_courses)
+
+# Keyset pagination: a page is the rows after (or before) an anchor id, so
+# every page costs the same however large the catalog is. One extra row is
+# fetched to tell whether there is a further page.
+def _load_courses_page(conn, anchor: int, forward: bool, limit: int):
+    if forward:
+        rows = conn.execute(
+            "SELECT id, name, url, channel_id FROM courses WHERE id > ? ORDER BY id LIMIT ?",
+            (anchor, limit + 1)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT id, name, url, channel_id FROM courses WHERE id < ? ORDER BY id DESC LIMIT ?",
+            (anchor, limit + 1)
+        ).fetchall()
+        rows.reverse()
+    return [tuple(row) for row in rows]
+
+async def load_courses_page(anchor: int, forward: bool, limit: int):
+    return await pool.run(_load_courses_page, anchor, forward, limit)
+
+def _load_course(conn, course_id: int):
+    row = conn.execute("SELECT name, url, channel_id FROM courses WHERE id = ?", (course_id,)).fetchone()
+    return tuple(row) if row else None
+
+async def load_course(course_id: int):
+    return await pool.run(_load_course, course_id)
+
+# course_ids=None means every course
+def _load_course_channels(conn, course_ids):
+    if course_ids is None:
+        return [row[0] for row in conn.execute("SELECT channel_id FROM courses ORDER BY id")]
+    ids = list(course_ids)
+    channels = []
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        channels += [row[0] for row in conn.execute(
+            f"SELECT channel_id FROM courses WHERE id IN ({','.join('?' * len(chunk))})", chunk
+        )]
+    return channels
+
+async def load_course_channels(course_ids=None):
+    return await pool.run(_load_course_channels, course_ids)
+
+def _search_courses(conn, text: str, limit: int):
+    # Every word must match as a prefix: "грам экс" finds "Экспресс-грамматика"
+    words = re.findall(r"\w+", text)
+    if not words:
+        return []
+    match = " ".join(f'"{word}"*' for word in words)
+    return [tuple(row) for row in conn.execute(
         """
+        SELECT c.id, c.name, c.url, c.channel_id
+        FROM courses_fts JOIN courses c ON c.id = courses_fts.rowid
+        WHERE courses_fts MATCH ?
+        ORDER BY rank
+        LIMIT ?
+        """,
+        (match, limit)
+    )]
+
+async def search_courses(text: str, limit: int):
+    return await pool.run(_search_courses, text, limit)
+
+
+# Record payment only if not exists
+def _record_payment(conn, user_id: int) -> bool:
+    cur = conn.execute(
+        "SELECT 1 FROM payments WHERE user_id = ?",
+        (user_id, )
     )
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS payments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE NOT NULL,
-            paid_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    if cur.fetchone(): return True
+    else: return False
+
+async def record_payment(user_id: int) -> bool:
+    # Once warmed, the index is authoritative and /start never hits SQLite
+    if paid_users.loaded:
+        return user_id in paid_users
+    return await pool.run(_record_payment, user_id)
+
+def _load_paid_user_ids(conn) -> array:
+    return array('q', (row[0] for row in conn.execute("SELECT user_id FROM payments ORDER BY user_id")))
+
+async def warm_paid_users():
+    paid_users.load(await pool.run(_load_paid_user_ids))
+
+# Payment ledger
+
+def _record_ledger_entries(conn, entries):
+    now = int(time.time())
+    extended = []
+    with conn:
+        for entry in entries:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO payment_ledger (telegram_payment_charge_id, provider_payment_charge_id, "
+                "user_id, amount, currency, period_days, payload) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                entry
+            )
+            if not cur.rowcount:
+                continue
+            user_id, period = entry[2], entry[5] * 86400
+            # A renewal extends the running period instead of failing on the unique user_id
+            conn.execute(
+                "INSERT INTO payments (user_id, expires_at) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET paid_at = CURRENT_TIMESTAMP, reminded = 0, "
+                "expires_at = MAX(COALESCE(payments.expires_at, 0), ?) + ?",
+                (user_id, now + period, now, period)
+            )
+            expires_at = conn.execute("SELECT expires_at FROM payments WHERE user_id = ?", (user_id,)).fetchone()[0]
+            extended.append((user_id, expires_at))
+    return extended
+
+# entries are (telegram_payment_charge_id, provider_payment_charge_id, user_id,
+# amount, currency, period_days, payload) tuples; returns (user_id, expires_at)
+# for every entry not seen before
+async def record_ledger_entries(entries):
+    return await pool.write(_record_ledger_entries, entries)
+
+def _storable(value):
+    # Whatever kept the entry out of the ledger must not keep it out of here too
+    return value if value is None or isinstance(value, (int, float, str, bytes)) else repr(value)
+
+def _record_dead_letters(conn, failed):
+    with conn:
+        conn.executemany(
+            "INSERT INTO payment_dead_letters (telegram_payment_charge_id, provider_payment_charge_id, "
+            "user_id, amount, currency, period_days, payload, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [tuple(_storable(value) for value in entry) + (error,) for entry, error in failed]
         )
-        """
-    )
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE NOT NULL,
-            first_name TEXT,
-            last_name TEXT,
-            username TEXT,
-            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+
+# failed is a list of (ledger entry, error message) pairs
+async def record_dead_letters(failed):
+    await pool.write(_record_dead_letters, failed)
+
+# Bulk import/export, see transfer.py
+# table -> (exported columns, imported columns, insert statement)
+TRANSFER_TABLES = {
+    'courses': (
+        ('id', 'name', 'url', 'channel_id'),
+        ('name', 'url', 'channel_id'),
+        "INSERT OR IGNORE INTO courses (name, url, channel_id) VALUES (?, ?, COALESCE(?, '-1002519961960'))"
+    ),
+    'users': (
+        ('user_id', 'first_name', 'last_name', 'username', 'joined_at'),
+        ('user_id', 'first_name', 'last_name', 'username', 'joined_at'),
+        "INSERT OR IGNORE INTO users (user_id, first_name, last_name, username, joined_at) "
+        "VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))"
+    ),
+    # An existing subscription keeps the later expiry; NULL never expires
+    'payments': (
+        ('user_id', 'paid_at', 'expires_at', 'reminded'),
+        ('user_id', 'paid_at', 'expires_at'),
+        "INSERT INTO payments (user_id, paid_at, expires_at) VALUES (?, COALESCE(?, CURRENT_TIMESTAMP), ?) "
+        "ON CONFLICT (user_id) DO UPDATE SET "
+        "expires_at = CASE WHEN payments.expires_at IS NULL OR excluded.expires_at IS NULL THEN NULL "
+        "ELSE MAX(payments.expires_at, excluded.expires_at) END, "
+        "reminded = CASE WHEN excluded.expires_at IS NULL OR excluded.expires_at > payments.expires_at "
+        "THEN 0 ELSE payments.reminded END"
+    ),
+    'support': (
+        ('user_id',),
+        ('user_id',),
+        "INSERT OR IGNORE INTO support (user_id) VALUES (?)"
+    ),
+}
+
+# ``write(columns, cursor)`` runs on the pool thread and iterates the cursor,
+# so the table is streamed rather than loaded
+def _export_table(conn, table: str, write):
+    columns = TRANSFER_TABLES[table][0]
+    cur = conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id")
+    cur.arraysize = 1000
+    return write(columns, cur)
+
+async def export_table(table: str, write):
+    return await pool.run(_export_table, table, write)
+
+# ``chunks`` yields lists of row tuples; all of them go in one transaction
+def _import_rows(conn, table: str, chunks) -> int:
+    sql = TRANSFER_TABLES[table][2]
+    changed = 0
+    with conn:
+        for chunk in chunks:
+            # rowcount leaves out trigger writes (the courses_fts sync), unlike total_changes
+            changed += conn.executemany(sql, chunk).rowcount
+    return changed
+
+async def import_rows(table: str, chunks) -> int:
+    changed = await pool.write(_import_rows, table, chunks)
+    if changed and table == 'courses':
+        _bump_courses_version()
+    elif changed and table == 'support':
+        _bump_roles_version()
+    return changed
+
+# Media file_ids, see media.py
+
+def _load_media_file(conn, sha256: str):
+    row = conn.execute("SELECT file_id FROM media_files WHERE sha256 = ?", (sha256,)).fetchone()
+    return row[0] if row else None
+
+async def load_media_file(sha256: str):
+    return await pool.run(_load_media_file, sha256)
+
+def _save_media_file(conn, sha256: str, kind: str, file_id: str):
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO media_files (sha256, kind, file_id) VALUES (?, ?, ?)",
+            (sha256, kind, file_id)
         )
-        """
-    )
+
+async def save_media_file(sha256: str, kind: str, file_id: str):
+    await pool.write(_save_media_file, sha256, kind, file_id)
+
+def _delete_media_file(conn, sha256: str):
+    with conn:
+        conn.execute("DELETE FROM media_files WHERE sha256 = ?", (sha256,))
+
+async def delete_media_file(sha256: str):
+    await pool.write(_delete_media_file, sha256)
+
+# Channel membership snapshots, see membership.py
+
+def _load_channel_sync(conn, channel_id: int):
+    row = conn.execute(
+        "SELECT last_event_id, synced_at FROM channel_sync WHERE channel_id = ?", (channel_id,)
+    ).fetchone()
+    return tuple(row) if row else None
+
+async def load_channel_sync(channel_id: int):
+    return await pool.run(_load_channel_sync, channel_id)
+
+def _save_channel_sync(conn, channel_id: int, last_event_id: int, synced_at: int):
     conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS support (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER UNIQUE NOT NULL
-        )
-        """
+        "INSERT INTO channel_sync (channel_id, last_event_id, synced_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(channel_id) DO UPDATE SET last_event_id = excluded.last_event_id, synced_at = excluded.synced_at",
+        (channel_id, last_event_id, synced_at)
     )
-    # Seed default courses
-    cur = conn.execute("SELECT COUNT(*) AS cnt FROM courses")
-    if cur.fetchone()["cnt"] == 0:
+
+# members are (user_id, is_admin) pairs; pending warnings survive the rescan
+def _replace_channel_members(conn, channel_id: int, members, last_event_id: int, synced_at: int):
+    with conn:
+        warned = dict(conn.execute(
+            "SELECT user_id, warned_at FROM channel_members WHERE channel_id = ? AND warned_at IS NOT NULL",
+            (channel_id,)
+        ))
+        conn.execute("DELETE FROM channel_members WHERE channel_id = ?", (channel_id,))
         conn.executemany(
-            "INSERT INTO  courses (name, url) VALUES (?, ?)",
-            [("Экспресс-грамматика", "https://t.me/+uKg4xGQ0MDtkMTBi"), ("Путешествия", "https://t.me/+umKj0R00Rb9jNzE6")]
+            "INSERT OR REPLACE INTO channel_members (channel_id, user_id, is_admin, warned_at) VALUES (?, ?, ?, ?)",
+            ((channel_id, user_id, int(is_admin), warned.get(user_id)) for user_id, is_admin in members)
         )
-    conn.commit()
+        _save_channel_sync(conn, channel_id, last_event_id, synced_at)
 
-# --- Helpers ---
-def load_courses_url():
-    with get_db_connection() as conn:
-        return {row["name"]: row["url"] for row in conn.execute("SELECT name, url FROM courses ORDER BY id")}
+async def replace_channel_members(channel_id: int, members, last_event_id: int, synced_at: int):
+    await pool.write(_replace_channel_members, channel_id, members, last_event_id, synced_at)
 
-def load_courses_id():
-    with get_db_connection() as conn:
-        return {row['name']: row['channel_id'] for row in conn.execute("SELECT name, channel_id FROM courses ORDER BY id")}
+# changes maps user_id -> is_admin for members, or None for users who left
+def _apply_channel_changes(conn, channel_id: int, changes: dict, last_event_id: int, synced_at: int):
+    with conn:
+        conn.executemany(
+            "INSERT INTO channel_members (channel_id, user_id, is_admin) VALUES (?, ?, ?) "
+            "ON CONFLICT(channel_id, user_id) DO UPDATE SET is_admin = excluded.is_admin",
+            ((channel_id, user_id, int(is_admin)) for user_id, is_admin in changes.items() if is_admin is not None)
+        )
+        conn.executemany(
+            "DELETE FROM channel_members WHERE channel_id = ? AND user_id = ?",
+            ((channel_id, user_id) for user_id, is_admin in changes.items() if is_admin is None)
+        )
+        _save_channel_sync(conn, channel_id, last_event_id, synced_at)
 
+async def apply_channel_changes(channel_id: int, changes: dict, last_event_id: int, synced_at: int):
+    await pool.write(_apply_channel_changes, channel_id, changes, last_event_id, synced_at)
 
-# Record payment only if not exists
-def record_payment(user_id: int) -> bool:
-    with get_db_connection() as conn:
+def _load_unpaid_members(conn, channel_id: int, warned_before: int):
+    # Members without a payments row who were never warned, or warned before ``warned_before``
+    return [tuple(row) for row in conn.execute(
+        "SELECT user_id, warned_at FROM channel_members m "
+        "WHERE channel_id = ? AND is_admin = 0 AND (warned_at IS NULL OR warned_at <= ?) "
+        "AND NOT EXISTS (SELECT 1 FROM payments p WHERE p.user_id = m.user_id)",
+        (channel_id, warned_before)
+    )]
+
+async def load_unpaid_members(channel_id: int, warned_before: int):
+    return await pool.run(_load_unpaid_members, channel_id, warned_before)
+
+def _clear_paid_warnings(conn, channel_id: int):
+    with conn:
+        conn.execute(
+            "UPDATE channel_members SET warned_at = NULL WHERE channel_id = ? AND warned_at IS NOT NULL "
+            "AND EXISTS (SELECT 1 FROM payments p WHERE p.user_id = channel_members.user_id)",
+            (channel_id,)
+        )
+
+async def clear_paid_warnings(channel_id: int):
+    await pool.write(_clear_paid_warnings, channel_id)
+
+def _mark_members_warned(conn, channel_id: int, user_ids, warned_at: int):
+    with conn:
+        conn.executemany(
+            "UPDATE channel_members SET warned_at = ? WHERE channel_id = ? AND user_id = ?",
+            ((warned_at, channel_id, user_id) for user_id in user_ids)
+        )
+
+async def mark_members_warned(channel_id: int, user_ids, warned_at: int):
+    await pool.write(_mark_members_warned, channel_id, user_ids, warned_at)
+
+def _remove_channel_members(conn, channel_id: int, user_ids):
+    with conn:
+        conn.executemany(
+            "DELETE FROM channel_members WHERE channel_id = ? AND user_id = ?",
+            ((channel_id, user_id) for user_id in user_ids)
+        )
+
+async def remove_channel_members(channel_id: int, user_ids):
+    await pool.write(_remove_channel_members, channel_id, user_ids)
+
+# Kaspi receipts
+
+def _load_receipt_check(conn, sha256: str):
+    row = conn.execute(
+        "SELECT user_id, ok, amount, reason FROM receipt_checks WHERE sha256 = ?", (sha256,)
+    ).fetchone()
+    return tuple(row) if row else None
+
+async def load_receipt_check(sha256: str):
+    return await pool.run(_load_receipt_check, sha256)
+
+def _save_receipt_check(conn, sha256: str, user_id: int, ok: bool, amount, reason):
+    with conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO receipt_checks (sha256, user_id, ok, amount, reason) VALUES (?, ?, ?, ?, ?)",
+            (sha256, user_id, int(ok), amount, reason)
+        )
+
+async def save_receipt_check(sha256: str, user_id: int, ok: bool, amount, reason):
+    await pool.write(_save_receipt_check, sha256, user_id, ok, amount, reason)
+
+def _consume_receipt(conn, sha256: str, user_id: int) -> bool:
+    with conn:
         cur = conn.execute(
-            "SELECT 1 FROM payments WHERE user_id = ?",
-            (user_id, )
+            "UPDATE receipt_checks SET consumed_at = CAST(strftime('%s', 'now') AS INTEGER) "
+            "WHERE sha256 = ? AND user_id = ? AND ok = 1 AND consumed_at IS NULL",
+            (sha256, user_id)
         )
-        if cur.fetchone(): return True
-        else: return False
+    return cur.rowcount == 1
 
-def update_record_payment(user_id: int) -> bool:
-    try:
-        with get_db_connection() as conn:
-            conn.execute(
-                "INSERT INTO payments (user_id) VALUES (?)",
-                (user_id, ))
-            conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False
+# True only for the first caller: a receipt is credited once, whoever sends it again
+async def consume_receipt(sha256: str, user_id: int) -> bool:
+    return await pool.write(_consume_receipt, sha256, user_id)
+
+# Subscription expiry
+
+def _load_expiring(conn, after_expires_at: int, after_user_id: int, limit: int):
+    # Keyset pagination over idx_payments_expires_at
+    return [tuple(row) for row in conn.execute(
+        "SELECT user_id, expires_at, reminded FROM payments "
+        "WHERE expires_at IS NOT NULL AND (expires_at, user_id) > (?, ?) "
+        "ORDER BY expires_at, user_id LIMIT ?",
+        (after_expires_at, after_user_id, limit)
+    )]
+
+async def load_expiring(after_expires_at: int, after_user_id: int, limit: int):
+    return await pool.run(_load_expiring, after_expires_at, after_user_id, limit)
+
+def _mark_reminded(conn, pairs):
+    with conn:
+        conn.executemany("UPDATE payments SET reminded = 1 WHERE user_id = ? AND expires_at = ?", pairs)
+
+# pairs are (user_id, expires_at); rows renewed in the meantime are left alone
+async def mark_reminded(pairs):
+    await pool.write(_mark_reminded, pairs)
+
+def _revoke_expired(conn, pairs):
+    revoked = []
+    with conn:
+        for user_id, expires_at in pairs:
+            cur = conn.execute("DELETE FROM payments WHERE user_id = ? AND expires_at = ?", (user_id, expires_at))
+            if cur.rowcount:
+                revoked.append(user_id)
+    return revoked
+
+async def revoke_expired(pairs):
+    return await pool.write(_revoke_expired, pairs)
 
 # Course and support commands
 
-def not_admin(user_id: int) -> bool:
-    try:
-        with get_db_connection() as conn:
-            cur = conn.execute("SELECT * FROM admin WHERE user_id = ?",
-                         (user_id,))
-            if cur.fetchone():
-                return False
-            return True
-    except sqlite3.IntegrityError:
-        return False
+# Bumped after every write to ``support`` so roles.RoleCache reloads; the
+# ``admin`` table is edited by hand and picked up on the cache TTL.
+roles_version = 0
 
-def add_course_to_db(name: str, url: str, id: str) -> bool:
+def _bump_roles_version():
+    global roles_version
+    roles_version += 1
+
+def _load_roles(conn):
+    admins = frozenset(row[0] for row in conn.execute("SELECT user_id FROM admin"))
+    support = frozenset(row[0] for row in conn.execute("SELECT user_id FROM support"))
+    return admins, support
+
+async def load_roles():
+    return await pool.run(_load_roles)
+
+def _add_course_to_db(conn, name: str, url: str, id: str) -> bool:
     try:
-        with get_db_connection() as conn:
+        with conn:
             conn.execute("INSERT INTO courses (name, url, channel_id) VALUES (?, ?, ?)",
                          (name, url, id))
-            conn.commit()
         return True
     except sqlite3.IntegrityError:
         return False
 
-def rename_course_in_db(old: str, new: str) -> bool:
-    with get_db_connection() as conn:
+async def add_course_to_db(name: str, url: str, id: str) -> bool:
+    added = await pool.write(_add_course_to_db, name, url, id)
+    if added:
+        _bump_courses_version()
+    return added
+
+def _rename_course_in_db(conn, old: str, new: str) -> bool:
+    with conn:
         cur = conn.execute(
             "UPDATE courses SET name = ? WHERE name = ?", (new, old)
         )
-        conn.commit()
-        return cur.rowcount > 0
+    return cur.rowcount > 0
 
-def save_new_user(user: aio_types.User):
-    with get_db_connection() as conn:
-        cur = conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user.id,))
-        if not cur.fetchone():
-            conn.execute(
-                "INSERT INTO users (user_id, first_name, last_name, username) VALUES (?, ?, ?, ?)",
-                (user.id, user.first_name, user.last_name, user.username)
-            )
-            conn.commit()
+async def rename_course_in_db(old: str, new: str) -> bool:
+    renamed = await pool.write(_rename_course_in_db, old, new)
+    if renamed:
+        _bump_courses_version()
+    return renamed
 
-def load_support():
-    with get_db_connection() as conn:
-        support = {row['id']: row['user_id'] for row in conn.execute("SELECT id, user_id FROM courses ORDER BY id")}
-        return next(iter(support.values()))
+def _save_new_users(conn, rows):
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (user_id, first_name, last_name, username) VALUES (?, ?, ?, ?)",
+            rows
+        )
 
-def add_support(user_id: int):
-    with get_db_connection() as conn:
-        cur = conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user.id,))
+# rows are (user_id, first_name, last_name, username) tuples, see registrations.py
+async def save_new_users(rows):
+    await pool.write(_save_new_users, rows)
+
+def _add_support(conn, user_id: int):
+    with conn:
+        cur = conn.execute("SELECT 1 FROM support WHERE user_id = ?", (user_id,))
         if not cur.fetchone():
             conn.execute(
                 "INSERT INTO support (user_id) VALUES (?)",
                 (user_id,)
             )
-            conn.commit()
 
-def delete_support(user_id: int):
-    with get_db_connection() as conn:
+async def add_support(user_id: int):
+    await pool.write(_add_support, user_id)
+    _bump_roles_version()
+
+def _delete_support(conn, user_id: int):
+    with conn:
         conn.execute(
             "DELETE FROM support WHERE user_id = ?",
             (user_id,)
         )
-        conn.commit()
 
-def get_support():
-    with get_db_connection() as conn:
-        return {row['id']: row['user_id'] for row in conn.execute("SELECT id, user_id FROM support ORDER BY id")}
\ No newline at end of file
+async def delete_support(user_id: int):
+    await pool.write(_delete_support, user_id)
+    _bump_roles_version()
+
+def _get_support(conn):
+    return {row['id']: row['user_id'] for row in conn.execute("SELECT id, user_id FROM support ORDER BY id")}
+
+async def get_support():
+    return await pool.run(_get_support)
+
+
+# Broadcasts
+
+def _create_broadcast(conn, from_chat_id: int, message_id: int, admin_chat_id: int,
+                      chat_ids, include_paid: bool) -> int:
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO broadcasts (from_chat_id, message_id, admin_chat_id) VALUES (?, ?, ?)",
+            (from_chat_id, message_id, admin_chat_id)
+        )
+        broadcast_id = cur.lastrowid
+        conn.executemany(
+            "INSERT OR IGNORE INTO broadcast_targets (broadcast_id, chat_id) VALUES (?, ?)",
+            [(broadcast_id, chat_id) for chat_id in chat_ids]
+        )
+        if include_paid:
+            conn.execute(
+                "INSERT OR IGNORE INTO broadcast_targets (broadcast_id, chat_id) SELECT ?, user_id FROM payments",
+                (broadcast_id,)
+            )
+    return broadcast_id
+
+async def create_broadcast(from_chat_id: int, message_id: int, admin_chat_id: int,
+                           chat_ids, include_paid: bool) -> int:
+    return await pool.write(_create_broadcast, from_chat_id, message_id, admin_chat_id,
+                            list(chat_ids), include_paid)
+
+def _load_broadcast_targets(conn, broadcast_id: int, after_chat_id, limit: int):
+    # Keyset pagination over the primary key; NULL means "from the start"
+    return [row[0] for row in conn.execute(
+        "SELECT chat_id FROM broadcast_targets "
+        "WHERE broadcast_id = ? AND status = 'pending' AND (? IS NULL OR chat_id > ?) "
+        "ORDER BY chat_id LIMIT ?",
+        (broadcast_id, after_chat_id, after_chat_id, limit)
+    )]
+
+async def load_broadcast_targets(broadcast_id: int, after_chat_id, limit: int):
+    return await pool.run(_load_broadcast_targets, broadcast_id, after_chat_id, limit)
+
+def _mark_broadcast_targets(conn, broadcast_id: int, results):
+    with conn:
+        conn.executemany(
+            "UPDATE broadcast_targets SET status = ?, error = ? WHERE broadcast_id = ? AND chat_id = ?",
+            [(status, error, broadcast_id, chat_id) for chat_id, status, error in results]
+        )
+
+# results are (chat_id, status, error) tuples
+async def mark_broadcast_targets(broadcast_id: int, results):
+    await pool.write(_mark_broadcast_targets, broadcast_id, results)
+
+def _finish_broadcast(conn, broadcast_id: int) -> dict:
+    with conn:
+        conn.execute(
+            "UPDATE broadcasts SET status = 'done', finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (broadcast_id,)
+        )
+    return {row[0]: row[1] for row in conn.execute(
+        "SELECT status, COUNT(*) FROM broadcast_targets WHERE broadcast_id = ? GROUP BY status",
+        (broadcast_id,)
+    )}
+
+async def finish_broadcast(broadcast_id: int) -> dict:
+    return await pool.write(_finish_broadcast, broadcast_id)
+
+def _load_unfinished_broadcasts(conn):
+    return [tuple(row) for row in conn.execute(
+        "SELECT id, from_chat_id, message_id, admin_chat_id FROM broadcasts WHERE status = 'running' ORDER BY id"
+    )]
+
+async def load_unfinished_broadcasts():
+    return await pool.run(_load_unfinished_broadcasts)
+
+
+# FSM storage
+
+def _load_fsm_record(conn, key: str, not_before: float):
+    row = conn.execute(
+        "SELECT state, data, updated_at FROM fsm_storage WHERE key = ? AND updated_at >= ?",
+        (key, not_before)
+    ).fetchone()
+    return tuple(row) if row else None
+
+async def load_fsm_record(key: str, not_before: float):
+    return await pool.run(_load_fsm_record, key, not_before)
+
+def _save_fsm_records(conn, rows):
+    # An empty state with empty data is the same as no record at all
+    with conn:
+        conn.executemany(
+            "DELETE FROM fsm_storage WHERE key = ?",
+            [(key,) for key, state, data, _ in rows if state is None and data == '{}']
+        )
+        conn.executemany(
+            "INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at",
+            [row for row in rows if not (row[1] is None and row[2] == '{}')]
+        )
+
+# rows are (key, state, data_json, updated_at) tuples
+async def save_fsm_records(rows):
+    await pool.write(_save_fsm_records, rows)
+
+def _delete_expired_fsm_records(conn, before: float):
+    with conn:
+        conn.execute("DELETE FROM fsm_storage WHERE updated_at < ?", (before,))
+
+async def delete_expired_fsm_records(before: float):
+    await pool.write(_delete_expired_fsm_records, before)
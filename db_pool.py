@@ -0,0 +1,104 @@
+import time
+import asyncio
+import functools
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Connection tuning ---
+# WAL lets readers run alongside the single writer; NORMAL sync is safe with WAL
+# and avoids an fsync per commit.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+)
+
+
+class ConnectionPool:
+    """Long-lived SQLite connections served from worker threads.
+
+    Reads run on a small pool of threads, each holding its own connection.
+    Writes go through one dedicated thread so they never fight over the
+    database lock. Every connection keeps its own prepared statement cache.
+
+    If ``route()`` is set it picks the database file per call (``None`` means
+    ``path``); each thread then keeps one connection per file.
+    """
+
+    def __init__(self, path: str, size: int = 4, statement_cache: int = 256):
+        self.path = path
+        self.size = size
+        self.statement_cache = statement_cache
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._readers = None
+        self._writer = None
+        self.queries = 0
+        # Optional ``on_query(name, seconds)`` callback, see metrics.install
+        self.on_query = None
+        # Optional ``route() -> path``, see tenants.py
+        self.route = None
+
+    def connect(self, path: str = None) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            path or self.path,
+            check_same_thread=False,
+            cached_statements=self.statement_cache
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _connection(self, path: str) -> sqlite3.Connection:
+        conns = getattr(self._local, 'conns', None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get(path)
+        if conn is None:
+            conn = conns[path] = self.connect(path)
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _call(self, path, fn, args, kwargs):
+        return fn(self._connection(path), *args, **kwargs)
+
+    async def _submit(self, executor, fn, args, kwargs):
+        self.queries += 1
+        # Resolved here: executor threads don't see the caller's context
+        path = (self.route() if self.route is not None else None) or self.path
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(executor, functools.partial(self._call, path, fn, args, kwargs))
+        finally:
+            if self.on_query is not None:
+                self.on_query(fn.__name__, time.perf_counter() - started)
+
+    async def run(self, fn, *args, **kwargs):
+        """Run ``fn(conn, *args)`` on a reader thread."""
+        if self._readers is None:
+            self._readers = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='db-read')
+        return await self._submit(self._readers, fn, args, kwargs)
+
+    async def write(self, fn, *args, **kwargs):
+        """Run ``fn(conn, *args)`` on the writer thread."""
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-write')
+        return await self._submit(self._writer, fn, args, kwargs)
+
+    def close(self):
+        for executor in (self._readers, self._writer):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        self._readers = self._writer = None
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
@@ -0,0 +1,148 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+from datetime import datetime
+
+from aiogram import Bot
+
+import db
+from paid_users import paid_users
+from outbound import BULK, priority
+from tenants import TenantLocal
+
+# --- Configuration ---
+REMIND_BEFORE = int(os.getenv("EXPIRY_REMIND_BEFORE", 3 * 86400))
+# Only expiries this far past the reminder window are kept in memory
+LOOKAHEAD = int(os.getenv("EXPIRY_LOOKAHEAD", 86400))
+PAGE_SIZE = 1000
+BATCH_SIZE = 100
+REMIND, REVOKE = 0, 1
+
+
+class ExpiryEngine:
+    """Sends renewal reminders and revokes expired subscriptions.
+
+    Upcoming expiries live in a min-heap of ``(due, kind, user_id, expires_at)``.
+    Only the next ``REMIND_BEFORE + LOOKAHEAD`` seconds of the
+    ``idx_payments_expires_at`` index are loaded, page by page through a keyset
+    cursor, so the table is never scanned in full. Renewals push a new entry
+    and the stale one is skipped when popped.
+    """
+
+    def __init__(self):
+        self._heap = []
+        # user_id -> expires_at currently scheduled, for skipping stale entries
+        self._scheduled = {}
+        # Keyset cursor: everything up to (expires_at, user_id) is loaded
+        self._cursor = (0, 0)
+        self._exhausted = False
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._bot = None
+
+    @property
+    def horizon(self) -> float:
+        return float('inf') if self._exhausted else self._cursor[0]
+
+    def _push(self, user_id: int, expires_at: int, reminded: bool):
+        self._scheduled[user_id] = expires_at
+        if not reminded:
+            heapq.heappush(self._heap, (expires_at - REMIND_BEFORE, REMIND, user_id, expires_at))
+        heapq.heappush(self._heap, (expires_at, REVOKE, user_id, expires_at))
+
+    def schedule(self, user_id: int, expires_at: int):
+        """Called when a payment sets a new expiry for ``user_id``."""
+        if expires_at <= self.horizon:
+            self._push(user_id, expires_at, reminded=False)
+        else:
+            # Will be picked up when the cursor gets there
+            self._scheduled.pop(user_id, None)
+        self._wakeup.set()
+
+    def reload(self):
+        """Forget the loaded window after bulk changes to ``payments``."""
+        self._heap = []
+        self._scheduled = {}
+        self._cursor = (0, 0)
+        self._exhausted = False
+        self._wakeup.set()
+
+    async def _fill(self):
+        target = time.time() + REMIND_BEFORE + LOOKAHEAD
+        while not self._exhausted and self._cursor[0] < target:
+            rows = await db.load_expiring(self._cursor[0], self._cursor[1], PAGE_SIZE)
+            for user_id, expires_at, reminded in rows:
+                self._push(user_id, expires_at, bool(reminded))
+            if len(rows) < PAGE_SIZE:
+                self._exhausted = True
+            else:
+                self._cursor = (rows[-1][1], rows[-1][0])
+
+    def _pop_due(self, now: float):
+        reminders, revocations = [], []
+        while self._heap and self._heap[0][0] <= now and len(reminders) + len(revocations) < BATCH_SIZE:
+            _, kind, user_id, expires_at = heapq.heappop(self._heap)
+            if self._scheduled.get(user_id) != expires_at:
+                continue
+            if kind == REMIND:
+                reminders.append((user_id, expires_at))
+            else:
+                del self._scheduled[user_id]
+                revocations.append((user_id, expires_at))
+        return reminders, revocations
+
+    async def _notify(self, user_id: int, text: str):
+        try:
+            with priority(BULK):
+                await self._bot.send_message(user_id, text)
+        except Exception as e:
+            logging.warning("Could not notify %s: %s", user_id, e)
+
+    async def _process(self, reminders, revocations):
+        if reminders:
+            await db.mark_reminded(reminders)
+            for user_id, expires_at in reminders:
+                date = datetime.fromtimestamp(expires_at).strftime("%d.%m.%Y")
+                await self._notify(user_id, f"⏰ Ваша подписка заканчивается {date}. Продлите её через /start.")
+        if revocations:
+            for user_id in await db.revoke_expired(revocations):
+                paid_users.discard(user_id)
+                await self._notify(user_id, "Срок подписки истёк. Чтобы продлить доступ, нажмите /start.")
+
+    async def _run(self):
+        while True:
+            await self._fill()
+            now = time.time()
+            reminders, revocations = self._pop_due(now)
+            if reminders or revocations:
+                await self._process(reminders, revocations)
+                continue
+            # Sleep until the next entry is due, a new payment arrives, or the
+            # loaded window needs extending
+            delay = LOOKAHEAD / 2
+            if self._heap:
+                delay = min(delay, self._heap[0][0] - now)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(delay, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self, bot: Bot):
+        self._bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+expiry = TenantLocal(ExpiryEngine)
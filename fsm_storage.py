@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+import db
+import tenants
+
+# --- Configuration ---
+# Set FSM_CACHE_SIZE=0 when several processes share the database, so every
+# read goes to SQLite instead of a possibly stale local copy.
+CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", 10000))
+FLUSH_DELAY = float(os.getenv("FSM_FLUSH_DELAY", 0.5))
+STATE_TTL = float(os.getenv("FSM_STATE_TTL", 7 * 24 * 3600))
+CLEANUP_INTERVAL = 3600
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage persisted in the ``fsm_storage`` table.
+
+    An LRU cache answers repeated reads, writes are coalesced per key and
+    flushed in one transaction every ``FLUSH_DELAY`` seconds, and records
+    untouched for ``STATE_TTL`` seconds are treated as empty and purged.
+    """
+
+    def __init__(self, cache_size: int = CACHE_SIZE, flush_delay: float = FLUSH_DELAY, ttl: float = STATE_TTL):
+        self.cache_size = cache_size
+        self.flush_delay = flush_delay
+        self.ttl = ttl
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+        # key -> (state, data, updated_at)
+        self._cache = OrderedDict()
+        self._dirty = {}
+        self._inflight = {}
+        # key -> bot id, so each record is flushed to its tenant's database
+        self._bot_ids = {}
+        self._flush_task = None
+        self._last_cleanup = 0.0
+
+    def _remember(self, key: str, record):
+        if self.cache_size <= 0:
+            return
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _record(self, key: StorageKey):
+        skey = self.key_builder.build(key)
+        record = self._dirty.get(skey) or self._inflight.get(skey)
+        if record is None:
+            record = self._cache.get(skey)
+            if record is not None:
+                self._cache.move_to_end(skey)
+        if record is None:
+            row = await db.load_fsm_record(skey, time.time() - self.ttl)
+            # A write for this key may have landed while the row was loading;
+            # it is newer than the row, which must not replace it in the cache
+            record = self._dirty.get(skey) or self._inflight.get(skey) or self._cache.get(skey)
+            if record is None:
+                record = (row[0], json.loads(row[1]), row[2]) if row else (None, {}, 0.0)
+                self._remember(skey, record)
+        if record[2] < time.time() - self.ttl:
+            return skey, (None, {}, 0.0)
+        return skey, record
+
+    def _write(self, key: StorageKey, skey: str, state: Optional[str], data: Dict[str, Any]):
+        record = (state, data, time.time())
+        self._dirty[skey] = record
+        self._bot_ids[skey] = key.bot_id
+        self._remember(skey, record)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_delay)
+        await self.flush()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty = self._inflight = self._dirty
+        self._dirty = {}
+        by_bot = {}
+        for skey, (state, data, updated_at) in dirty.items():
+            by_bot.setdefault(self._bot_ids.get(skey), []).append((skey, state, json.dumps(data), updated_at))
+        try:
+            for bot_id, rows in by_bot.items():
+                with tenants.use_bot(bot_id):
+                    await db.save_fsm_records(rows)
+        except Exception:
+            logging.exception("Failed to persist %d FSM records, will retry", len(dirty))
+            for skey, record in dirty.items():
+                self._dirty.setdefault(skey, record)
+        else:
+            for skey in dirty:
+                if skey not in self._dirty:
+                    self._bot_ids.pop(skey, None)
+        finally:
+            self._inflight = {}
+        if time.monotonic() - self._last_cleanup > CLEANUP_INTERVAL:
+            self._last_cleanup = time.monotonic()
+            for tenant in tenants.registry.values() or [None]:
+                with tenants.use(tenant):
+                    await db.delete_expired_fsm_records(time.time() - self.ttl)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        skey, (_, data, _) = await self._record(key)
+        self._write(key, skey, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, (state, _, _) = await self._record(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        skey, (state, _, _) = await self._record(key)
+        self._write(key, skey, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, (_, data, _) = await self._record(key)
+        return data.copy()
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
@@ -0,0 +1,200 @@
+import os
+import asyncio
+import hashlib
+import logging
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import aiofiles
+from aiogram import Bot
+from aiogram import types as aio_types
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+
+import db
+import tenants
+from ledger import ledger
+from payment import PRICE, SUBSCRIPTION_DAYS
+
+# --- Configuration ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RECEIPTS_DIR = os.path.join(BASE_DIR, 'receipts')
+# Name the receipt must show; Kaspi payments are refused until it is set
+KASPI_RECIPIENT = os.getenv("KASPI_RECIPIENT", "")
+KASPI_PHONE = os.getenv("KASPI_PHONE", "")
+OCR_WORKERS = int(os.getenv("KASPI_OCR_WORKERS", 2))
+MAX_RECEIPT_SIZE = 20 * 1024 * 1024  # Bot API download limit
+CHUNK_SIZE = 64 * 1024
+EXPECTED_AMOUNT = PRICE.amount // 100
+
+_executor = None
+# (tenant, sha256) -> future, so the same receipt sent twice at once is OCR'd once
+_in_flight = {}
+
+
+class KaspiState(StatesGroup):
+    waiting_for_receipt = State()
+
+
+def _ocr_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=OCR_WORKERS)
+    return _executor
+
+
+def recipient() -> str:
+    return tenants.setting("KASPI_RECIPIENT", KASPI_RECIPIENT)
+
+
+def enabled() -> bool:
+    """Without a recipient any transfer of the right amount would pass, so Kaspi is off."""
+    return bool(recipient())
+
+
+UNAVAILABLE = "Оплата через Kaspi сейчас недоступна, выберите оплату картой."
+UNREADABLE = "Не удалось распознать чек. Попробуйте другой файл или обратитесь в техподдержку."
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def kaspi_handler(query: aio_types.CallbackQuery, state: FSMContext):
+    if not enabled():
+        await query.message.answer(UNAVAILABLE)
+        return
+    phone = tenants.setting("KASPI_PHONE", KASPI_PHONE)
+    await query.message.answer(
+        f"Переведите {EXPECTED_AMOUNT} ₸ через Kaspi"
+        + (f" на номер {phone}" if phone else "")
+        + f" ({recipient()}) и отправьте сюда чек в виде PDF или фото."
+    )
+    await state.set_state(KaspiState.waiting_for_receipt)
+
+
+def _discard(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def _download(bot: Bot, file_id: str, suffix: str):
+    """Stream the file to a new file in RECEIPTS_DIR, hashing it on the way. Returns (path, sha256).
+
+    Every download gets its own file, so two users sending the same receipt
+    at once don't write over each other.
+    """
+    file = await bot.get_file(file_id)
+    os.makedirs(RECEIPTS_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=RECEIPTS_DIR)
+    os.close(fd)
+    digest = hashlib.sha256()
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    try:
+        async with aiofiles.open(path, 'wb') as f:
+            async for chunk in bot.session.stream_content(url=url, chunk_size=CHUNK_SIZE, raise_for_status=True):
+                digest.update(chunk)
+                await f.write(chunk)
+    except BaseException:
+        _discard(path)
+        raise
+    return path, digest.hexdigest()
+
+
+async def _check(path: str, sha256: str, user_id: int):
+    """OCR the receipt and store the verdict, then delete the file. Returns (user_id, ok, amount, reason)."""
+    # Imported here so the bot process only loads the imaging libraries on
+    # the first receipt; the workers import it themselves
+    import receipt_ocr
+    try:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            _ocr_executor(), receipt_ocr.ocr_receipt, path, EXPECTED_AMOUNT, recipient()
+        )
+        if EXPECTED_AMOUNT not in result['amounts']:
+            ok, amount, reason = False, max(result['amounts'], default=None), "сумма не совпадает"
+        elif not result['recipient_found']:
+            ok, amount, reason = False, EXPECTED_AMOUNT, "получатель не совпадает"
+        else:
+            ok, amount, reason = True, EXPECTED_AMOUNT, None
+        await db.save_receipt_check(sha256, user_id, ok, amount, reason)
+    finally:
+        _discard(path)
+    return user_id, ok, amount, reason
+
+
+async def receipt_handler(message: aio_types.Message, state: FSMContext, bot: Bot):
+    if not enabled():
+        await state.clear()
+        await message.answer(UNAVAILABLE)
+        return
+    if message.document is not None:
+        file_id, size = message.document.file_id, message.document.file_size or 0
+        mime = message.document.mime_type or ""
+        if mime == "application/pdf":
+            suffix = ".pdf"
+        elif mime.startswith("image/"):
+            suffix = ".jpg"
+        else:
+            await message.answer("Пришлите чек в формате PDF или фото.")
+            return
+    elif message.photo:
+        photo = message.photo[-1]
+        file_id, size, suffix = photo.file_id, photo.file_size or 0, ".jpg"
+    else:
+        await message.answer("Пришлите чек в формате PDF или фото.")
+        return
+    if size > MAX_RECEIPT_SIZE:
+        await message.answer("Файл слишком большой, пришлите чек размером до 20 МБ.")
+        return
+
+    await message.answer("🔎 Проверяем чек, это может занять до минуты…")
+    user_id = message.from_user.id
+    try:
+        path, sha256 = await _download(bot, file_id, suffix)
+    except Exception:
+        logging.exception("Receipt download failed for %s", user_id)
+        await message.answer(UNREADABLE)
+        return
+
+    # A receipt is OCR'd once; later submissions reuse the stored verdict.
+    # The file goes once the verdict is stored, or right away if it isn't needed
+    checking = False
+    # Tenants have separate databases, so each checks (and credits) a receipt on its own
+    tenant = tenants.get()
+    key = (tenant.name if tenant is not None else None, sha256)
+    try:
+        cached = await db.load_receipt_check(sha256)
+        if cached is None:
+            future = _in_flight.get(key)
+            if future is None:
+                future = _in_flight[key] = asyncio.ensure_future(_check(path, sha256, user_id))
+                future.add_done_callback(lambda _: _in_flight.pop(key, None))
+                checking = True
+            try:
+                cached = await asyncio.shield(future)
+            except Exception:
+                logging.exception("Receipt OCR failed for %s", sha256)
+                await message.answer(UNREADABLE)
+                return
+    finally:
+        if not checking:
+            _discard(path)
+    owner_id, ok, amount, reason = cached
+
+    if not ok:
+        await message.answer(f"🚫 Чек не прошёл проверку: {reason}.")
+        return
+    if owner_id != user_id or not await db.consume_receipt(sha256, user_id):
+        await message.answer("🚫 Этот чек уже был использован.")
+        return
+
+    # Same path as a card payment, keyed by the receipt hash
+    ledger.submit((f"kaspi:{sha256}", None, user_id, amount * 100, "KZT", SUBSCRIPTION_DAYS, "kaspi-receipt"))
+    await state.clear()
+    await message.answer(f"✅ Оплата {amount} ₸ подтверждена! Нажмите /start, чтобы открыть курсы.")
@@ -0,0 +1,120 @@
+import os
+import asyncio
+import logging
+
+import db
+from paid_users import paid_users
+from expiry import expiry
+from tenants import TenantLocal
+
+# Commit after this many confirmations or this many seconds, whichever comes first
+BATCH_SIZE = int(os.getenv("LEDGER_BATCH_SIZE", 100))
+BATCH_DELAY = float(os.getenv("LEDGER_BATCH_DELAY", 0.2))
+# Failed batch commits before the entries are retried one by one and the
+# ones that still fail are set aside in payment_dead_letters
+MAX_ATTEMPTS = int(os.getenv("LEDGER_MAX_ATTEMPTS", 5))
+
+
+class PaymentPipeline:
+    """Writes payment confirmations to ``payment_ledger`` in batches.
+
+    ``submit`` never waits for SQLite: the ledger row, keyed by
+    ``telegram_payment_charge_id``, is committed by a background task, and
+    only then is the user marked paid in memory. Replayed confirmations are
+    ignored, so they never grant access. A batch that keeps failing is split
+    up, so one bad entry can't hold back the payments behind it.
+    """
+
+    def __init__(self, batch_size: int = BATCH_SIZE, batch_delay: float = BATCH_DELAY,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_attempts = max_attempts
+        self._queue = asyncio.Queue()
+        self._batch = []
+        self._attempts = 0
+        self._task = None
+
+    def submit(self, entry: tuple):
+        self._queue.put_nowait(entry)
+
+    async def _fill_batch(self):
+        if not self._batch:
+            self._batch.append(await self._queue.get())
+        # Give a burst time to arrive, unless a full batch is already waiting
+        if len(self._batch) + self._queue.qsize() < self.batch_size:
+            await asyncio.sleep(self.batch_delay)
+        while len(self._batch) < self.batch_size and not self._queue.empty():
+            self._batch.append(self._queue.get_nowait())
+
+    async def _commit(self):
+        # The batch is only cleared once committed; inserts are idempotent,
+        # so retrying a batch that partly landed is harmless.
+        try:
+            if self._attempts >= self.max_attempts:
+                new, failed = await self._commit_each()
+            else:
+                new, failed = await db.record_ledger_entries(list(self._batch)), []
+        except Exception:
+            self._attempts += 1
+            logging.exception("Ledger commit failed (attempt %d), retrying %d payments",
+                              self._attempts, len(self._batch))
+            await asyncio.sleep(1)
+            return
+        logging.info("Ledger: %d payments committed, %d duplicates ignored",
+                     len(new), len(self._batch) - len(new) - len(failed))
+        self._batch = []
+        self._attempts = 0
+        for user_id, expires_at in new:
+            # The expiry engine may have revoked an older row while this one was queued
+            paid_users.add(user_id)
+            expiry.schedule(user_id, expires_at)
+        if failed:
+            logging.error("Ledger: moving %d payments to payment_dead_letters: %r", len(failed), failed)
+            try:
+                await db.record_dead_letters(failed)
+            except Exception:
+                # The database itself is failing; keep them and go on retrying one by one
+                logging.exception("Could not store dead-lettered payments, retrying them")
+                self._batch = [entry for entry, _ in failed]
+                self._attempts = self.max_attempts
+                await asyncio.sleep(1)
+
+    async def _commit_each(self):
+        """Commit the batch one entry at a time. Returns the new rows and
+        (entry, error) for each entry that failed on its own."""
+        new, failed = [], []
+        for entry in self._batch:
+            try:
+                new += await db.record_ledger_entries([entry])
+            except Exception as e:
+                failed.append((entry, repr(e)))
+        return new, failed
+
+    async def _run(self):
+        while True:
+            await self._fill_batch()
+            await self._commit()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Drain whatever is still queued
+        while not self._queue.empty():
+            self._batch.append(self._queue.get_nowait())
+        if self._batch:
+            for user_id, _ in await db.record_ledger_entries(self._batch):
+                paid_users.add(user_id)
+            self._batch = []
+
+
+ledger = TenantLocal(PaymentPipeline)
@@ -0,0 +1,204 @@
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import random
+import logging
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from aiogram import BaseMiddleware, Dispatcher
+
+import tenants
+
+# --- Configuration ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" (one object per line) or "text"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Also write to this file; written by the listener thread like stdout
+LOG_FILE = os.getenv("LOG_FILE", "")
+# Share of routine "update handled" records kept; slow or failed updates are always logged
+LOG_SAMPLE_UPDATES = float(os.getenv("LOG_SAMPLE_UPDATES", 0.1))
+SLOW_UPDATE = float(os.getenv("LOG_SLOW_UPDATE", 1.0))
+
+# Fields copied from the update being handled onto every record
+CONTEXT_FIELDS = ('update_id', 'user_id', 'handler', 'tenant')
+
+# Holds a dict per update, so inner middlewares and the callback router can
+# fill in the handler name for the outer middleware to see
+_context = contextvars.ContextVar('log_context', default=None)
+_listener = None
+
+
+def annotate(**fields):
+    """Add ``fields`` to every record logged for the current update."""
+    context = _context.get()
+    if context is not None:
+        context.update(fields)
+
+
+# --- Records ---
+class ContextFilter(logging.Filter):
+    """Stamps records with the current update's context.
+
+    Runs in the logging thread, before the record is queued, since context
+    variables don't reach the listener thread.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _context.get()
+        if context is not None:
+            for field in CONTEXT_FIELDS:
+                if field in context and not hasattr(record, field):
+                    setattr(record, field, context[field])
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a share of records logged with ``extra={'sample': rate}``.
+
+    Warnings and errors are never dropped.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, 'sample', None)
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        return random.random() < rate
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve args and the traceback here, while they are still valid,
+        # but keep them apart so the formatter can put them in separate fields
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS + ('latency_ms',):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The usual one-line format, with the update context appended as key=value pairs."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        line = super().formatMessage(record)
+        fields = [
+            f"{field}={value}" for field in CONTEXT_FIELDS + ('latency_ms',)
+            if (value := getattr(record, field, None)) is not None
+        ]
+        return f"{line} [{' '.join(fields)}]" if fields else line
+
+
+# --- Pipeline ---
+def setup(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, path: str = LOG_FILE) -> QueueListener:
+    """Route all logging through a queue to a background writer thread.
+
+    Callers on the event loop only format the message and enqueue it; the
+    stream and file writes happen on the listener's thread.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    formatter = JsonFormatter() if fmt == "json" else TextFormatter()
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if path:
+        handlers.append(logging.FileHandler(path, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    queue_handler = _QueueHandler(records)
+    queue_handler.addFilter(SamplingFilter())
+    queue_handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown():
+    """Write out whatever is still queued and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# --- Update context ---
+class UpdateLogger(BaseMiddleware):
+    """Outer middleware: sets the log context for an update and logs its outcome."""
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        tenant = tenants.get()
+        context = {
+            'update_id': event.update_id,
+            'user_id': user.id if user else None,
+            'tenant': tenant.name if tenant else None,
+        }
+        token = _context.set(context)
+        started = time.perf_counter()
+        try:
+            result = await handler(event, data)
+        except Exception as e:
+            # The traceback is logged by aiogram
+            logging.warning("Update %s failed: %r", event.update_id, e,
+                            extra={'latency_ms': round((time.perf_counter() - started) * 1000, 1)})
+            raise
+        else:
+            latency = time.perf_counter() - started
+            logging.info(
+                "Update %s handled", event.update_id,
+                extra={
+                    'latency_ms': round(latency * 1000, 1),
+                    'sample': None if latency >= SLOW_UPDATE else LOG_SAMPLE_UPDATES,
+                }
+            )
+            return result
+        finally:
+            _context.reset(token)
+
+
+class HandlerAnnotator(BaseMiddleware):
+    """Inner middleware: records which handler took the update."""
+
+    async def __call__(self, handler, event, data):
+        annotate(handler=data['handler'].callback.__name__)
+        return await handler(event, data)
+
+
+def install(dp: Dispatcher):
+    dp.update.outer_middleware(UpdateLogger())
+    for event_name, observer in dp.observers.items():
+        if event_name not in ('update', 'error'):
+            observer.middleware(HandlerAnnotator())
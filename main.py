@@ -1,8 +1,8 @@
 import os
 import asyncio
-import logging
 
-from aiogram import F, Bot, Dispatcher, types as aio_types
+from aiogram import Bot, Dispatcher, types as aio_types
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
 from aiogram.types import CallbackQuery
 from aiogram.types.message import ContentType
@@ -10,7 +10,26 @@ import basic_commands
 import support
 import payment
 import courses
+import kaspi
+import transfer
 import db
+from roles import roles
+from registrations import registrations
+from mtproto import mtproto
+from broadcast import broadcasts
+import webhook
+from fsm_storage import SQLiteStorage
+from outbound import OutboundSession, OutboundScheduler
+from user_locks import user_serializer
+import tenants
+import metrics
+import logs
+from paid_users import paid_users
+from callbacks import router, CourseCallback, CoursePageCallback, PostTargetCallback
+from tickets import tickets
+from ledger import ledger
+from expiry import expiry
+from membership import membership
 from aiogram.fsm.context import FSMContext
 from dotenv import load_dotenv
 
@@ -18,55 +37,135 @@ from dotenv import load_dotenv
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 load_dotenv(os.path.join(BASE_DIR, '.env'))
 TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
+# "polling" (default) or "webhook", see webhook.py for the webhook settings
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+# Self-hosted Bot API server (or the fake one in bench/), default is api.telegram.org
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL")
 
 
 # --- Bot Initialization ---
-logging.basicConfig(level=logging.INFO)
-bot = Bot(token=TOKEN)
-dp = Dispatcher()
+# Records are written by a background thread, see logs.py
+logs.setup()
+
+def make_bot(token: str, scheduler: OutboundScheduler = None) -> Bot:
+    # Outbound calls go through the priority scheduler, see outbound.py
+    kwargs = {'api': TelegramAPIServer.from_base(TELEGRAM_API_URL)} if TELEGRAM_API_URL else {}
+    return Bot(token=token, session=OutboundSession(scheduler=scheduler, **kwargs))
+
+# One bot per tenant, each with its own rate limits (see tenants.py);
+# otherwise the single bot from TELEGRAM_BOT_TOKEN
+if tenants.enabled():
+    bots = {t: make_bot(t.token, OutboundScheduler()) for t in tenants.registry.values()}
+else:
+    bots = {None: make_bot(TOKEN)}
+bot = next(iter(bots.values()))
+dp = tenants.TenantDispatcher(storage=SQLiteStorage())
+
+metrics.install(dp, list(bots.values()), db.pool)
+logs.install(dp)
+# One update at a time per user; callback queries are answered here, see user_locks.py
+dp.update.outer_middleware(user_serializer)
+metrics.metrics.gauge("paid_index", tenants.per_tenant(
+    lambda: {k: v for k, v in paid_users.stats().items() if k != 'compact'}
+))
+if tenants.enabled():
+    # Each tenant's bot has its own scheduler; the default one in outbound.py sits idle
+    metrics.metrics.gauge("outbound_queue", tenants.per_tenant(lambda: bots[tenants.get()].session.scheduler.depths()))
+metrics.metrics.gauge("db_pool", lambda: {'queries': db.pool.queries})
 
 # --- Handlers ---
+# Registered first, so no state or catch-all handler takes the service message
+@dp.message(lambda message: message.content_type == ContentType.REFUNDED_PAYMENT)
+async def refund_payment(message: aio_types.Message, bot: Bot):
+    return await payment.refund_payment(message, bot)
+
 @dp.message(Command("start"))
-async def start_handler(message: aio_types.Message, state: FSMContext):
+async def start_handler(message: aio_types.Message, state: FSMContext, bot: Bot):
+    await basic_commands.send_welcome_media(message, bot)
     return await basic_commands.start(message, state)
 
-@dp.callback_query(lambda c: c.data == "back", courses.ButtonStates.courses_page)
-async def course_page(call: CallbackQuery, state: FSMContext):
+@dp.message(Command("stats"))
+async def stats_handler(message: aio_types.Message):
+    return await basic_commands.stats(message)
+
+# Every callback query goes through one dict-based router, see callbacks.py
+@dp.callback_query()
+async def route_callback(query: CallbackQuery, state: FSMContext):
+    return await router.dispatch(query, state)
+
+@router.route("back", courses.ButtonStates.courses_page)
+async def course_page(call: CallbackQuery, state: FSMContext, data: str):
     return await courses.courses_handler(call, state)
 
-@dp.callback_query(lambda c: c.data == "back", courses.ButtonStates.main_page)
-async def start_page(call: CallbackQuery, state: FSMContext):
+@router.route("back", courses.ButtonStates.main_page)
+async def start_page(call: CallbackQuery, state: FSMContext, data: str):
     return await basic_commands.start(call.message, state)
 
-@dp.callback_query(lambda c: c.data == "courses")
-async def courses_handler(query: aio_types.CallbackQuery, state: FSMContext):
+@router.route("courses")
+async def courses_handler(query: aio_types.CallbackQuery, state: FSMContext, data: str):
     return await courses.courses_handler(query, state)
 
-@dp.callback_query(F.data.startswith("course:"))
-async def course_selection_handler(query: aio_types.CallbackQuery, state: FSMContext):
-    return await courses.course_selection_handler(query, state)
+@router.route(CourseCallback)
+async def course_selection_handler(query: aio_types.CallbackQuery, state: FSMContext, data: CourseCallback):
+    return await courses.course_selection_handler(query, state, data)
+
+@router.route(CoursePageCallback)
+async def course_page_handler(query: aio_types.CallbackQuery, state: FSMContext, data: CoursePageCallback):
+    return await courses.course_page_handler(query, state, data)
 
-@dp.callback_query(lambda c: c.data == "support")
-async def support_handler(query: aio_types.CallbackQuery, state: FSMContext):
+@dp.inline_query()
+async def course_search_handler(inline_query: aio_types.InlineQuery):
+    return await courses.course_search_handler(inline_query)
+
+@router.route("support")
+async def support_handler(query: aio_types.CallbackQuery, state: FSMContext, data: str):
     return await support.support_handler(query, state)
 
-@dp.callback_query(lambda c: c.data == "add_support")
-async def add_support_handler(query: aio_types.CallbackQuery):
+# Curator management: callback data can be forged, so check the sender, not the menu
+@router.route("add_support")
+async def add_support_handler(query: aio_types.CallbackQuery, state: FSMContext, data: str):
+    if not await roles.is_admin(query.from_user.id):
+        return
     return await support.add_support(query.message)
 
-@dp.callback_query(lambda c: c.data == "remove_support")
-async def delete_support_handler(query: aio_types.CallbackQuery):
+@router.route("remove_support")
+async def delete_support_handler(query: aio_types.CallbackQuery, state: FSMContext, data: str):
+    if not await roles.is_admin(query.from_user.id):
+        return
     return await support.delete_support(query.message)
 
-@dp.callback_query(lambda c: c.data == "get_support")
-async def get_support_handler():
+@router.route("get_support")
+async def get_support_handler(query: aio_types.CallbackQuery, state: FSMContext, data: str):
+    if not await roles.is_admin(query.from_user.id):
+        return
     return await support.get_support()
 
 
 @dp.message(support.SupportForm.message)
-async def support_message_handler(message: aio_types.Message, state: FSMContext):
+async def support_message_handler(message: aio_types.Message, state: FSMContext, bot: Bot):
     return await support.support_message_handler(message, state, bot)
 
+# A curator answering a forwarded ticket message by replying to it.
+# Looked up per update so each tenant checks its own tickets.
+def ticket_reply(message: aio_types.Message):
+    return tickets.reply_filter(message)
+
+@dp.message(Command("close"), ticket_reply)
+async def close_ticket_handler(message: aio_types.Message, ticket, bot: Bot):
+    return await support.close_ticket_handler(message, ticket, bot)
+
+@dp.message(ticket_reply)
+async def curator_reply_handler(message: aio_types.Message, ticket, bot: Bot):
+    return await support.curator_reply_handler(message, ticket, bot)
+
+@dp.message(Command("export"))
+async def export_handler(message: aio_types.Message, bot: Bot):
+    return await transfer.export_handler(message, bot)
+
+@dp.message(Command("import"))
+async def import_handler(message: aio_types.Message, bot: Bot):
+    return await transfer.import_handler(message, bot)
+
 @dp.message(Command("addcourse"))
 async def add_course_handler(message: aio_types.Message, state: FSMContext):
     return await courses.add_course_handler(message, state)
@@ -83,48 +182,94 @@ async def rename_course_handler(message: aio_types.Message):
 async def create_post(message: aio_types.Message, state: FSMContext):
     return await courses.create_post(message, state)
 
-@dp.callback_query(lambda F: F.data.startswith("course_id:"), courses.PostStates.choosing_course)
-async def course_choice_handler(callback: aio_types.CallbackQuery, state: FSMContext):
-     return await courses.course_choice_handler(callback, state)
+@router.route(PostTargetCallback, courses.PostStates.choosing_course)
+async def course_choice_handler(callback: aio_types.CallbackQuery, state: FSMContext, data: PostTargetCallback):
+     return await courses.course_choice_handler(callback, state, data)
+
+@router.route(CoursePageCallback, courses.PostStates.choosing_course)
+async def post_targets_page_handler(callback: aio_types.CallbackQuery, state: FSMContext, data: CoursePageCallback):
+    return await courses.post_targets_page_handler(callback, state, data)
 
 @dp.message(courses.PostStates.waiting_for_content)
-async def post_content_handler(message: aio_types.Message, state: FSMContext):
+async def post_content_handler(message: aio_types.Message, state: FSMContext, bot: Bot):
     return await courses.post_content_handler(message, state, bot)
 
+@dp.message(kaspi.KaspiState.waiting_for_receipt)
+async def receipt_handler(message: aio_types.Message, state: FSMContext, bot: Bot):
+    return await kaspi.receipt_handler(message, state, bot)
+
 @dp.message()
-async def handle_random_message(message: aio_types.Message, state: FSMContext):
+async def handle_random_message(message: aio_types.Message, state: FSMContext, bot: Bot):
     if message.successful_payment:
         return await payment.successful_payment(message, bot)
+    # Follow-up messages on an open ticket go to the same curator
+    if tickets.active(message.from_user.id) is not None:
+        return await support.forward_to_curator(message, bot)
     return await basic_commands.handle_random_message(message, state)
 
 # Payments
-@dp.callback_query(lambda F: F.data.startswith("bank"), payment.PaymentState.awaiting_payment)
-async def payment_handler(query: CallbackQuery, state: FSMContext):
-    return await payment.payment_handler(query, bot)
+@router.route("bank", payment.PaymentState.awaiting_payment)
+async def payment_handler(query: CallbackQuery, state: FSMContext, data: str):
+    return await payment.payment_handler(query, query.bot)
 
 # pre checkout  (must be answered in 10 seconds)
 @dp.pre_checkout_query(lambda query: True)
-async def pre_checkout_query(pre_checkout_q: aio_types.PreCheckoutQuery):
+async def pre_checkout_query(pre_checkout_q: aio_types.PreCheckoutQuery, bot: Bot):
     return await payment.pre_checkout_query(pre_checkout_q, bot)
 
 
-# # successful payment
-# @dp.message.register(lambda message: message.successful_payment is not None)
-# async def successful_payment(message: aio_types.Message):
-#     return await payment.successful_payment(message, bot)
-#
-# @dp.message.register(lambda message: message.content_type == aio_types.ContentType.REFUNDED_PAYMENT)
-# async def refund_payment(message: aio_types.Message):
-#     return await payment.refund_payment(message, bot)
-
-@dp.callback_query(lambda F: F.data.startswith("kaspi"), payment.PaymentState.awaiting_payment)
-async def kaspi_handler(query: CallbackQuery, state: FSMContext):
-    await query.message.answer(text="kaspi payment")
+@router.route("kaspi", payment.PaymentState.awaiting_payment)
+async def kaspi_handler(query: CallbackQuery, state: FSMContext, data: str):
+    return await kaspi.kaspi_handler(query, state)
 
 
 # --- Main ---
+metrics_runner = None
+
+async def on_startup():
+    global metrics_runner
+    metrics_runner = await metrics.serve()
+    if mtproto.configured:
+        await mtproto.start()
+    for tenant, tenant_bot in bots.items():
+        # Tasks started here keep the tenant's context, and so its database
+        with tenants.use(tenant):
+            if tenant is not None:
+                tenant.migrate()
+            await db.warm_paid_users()
+            await roles.refresh()
+            registrations.start()
+            ledger.start()
+            expiry.start(tenant_bot)
+            await broadcasts.resume(tenant_bot)
+            # Channel membership is read through the MTProto account
+            if mtproto.configured:
+                membership.start(tenant_bot)
+
+async def on_shutdown():
+    await broadcasts.stop()
+    for tenant in bots:
+        with tenants.use(tenant):
+            await membership.stop()
+            await expiry.stop()
+            await registrations.stop()
+            await ledger.stop()
+    await mtproto.stop()
+    kaspi.shutdown()
+    db.pool.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    logs.shutdown()
+
 async def main():
-    await dp.start_polling(bot)
+    await on_startup()
+    try:
+        if BOT_MODE == "webhook":
+            await webhook.serve(dp, bots)
+        else:
+            await dp.start_polling(*bots.values())
+    finally:
+        await on_shutdown()
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -0,0 +1,99 @@
+import os
+import asyncio
+import hashlib
+import logging
+
+from aiogram import Bot
+from aiogram import types as aio_types
+from aiogram.exceptions import TelegramBadRequest
+
+import db
+from tenants import TenantLocal
+
+# How each kind of media is sent, and where its file_id is in the reply
+SEND_METHODS = {
+    'photo': 'send_photo',
+    'video': 'send_video',
+    'animation': 'send_animation',
+    'document': 'send_document',
+}
+
+
+def _file_id(message: aio_types.Message, kind: str) -> str:
+    if kind == 'photo':
+        return message.photo[-1].file_id
+    return getattr(message, kind).file_id
+
+
+class MediaRegistry:
+    """Uploads each media asset to Telegram once and reuses its ``file_id``.
+
+    Assets are local paths or URLs. The first send reads the bytes and looks
+    the SHA-256 up in ``media_files``; only content Telegram has never seen
+    is uploaded. After that ``source -> file_id`` is answered from memory, so
+    nothing is read, downloaded or uploaded again.
+    """
+
+    def __init__(self):
+        # source -> (sha256, file_id)
+        self._hot = {}
+        self._locks = {}
+
+    async def _read(self, bot: Bot, source: str) -> bytes:
+        if source.startswith(("http://", "https://")):
+            chunks = [chunk async for chunk in bot.session.stream_content(url=source, raise_for_status=True)]
+            return b"".join(chunks)
+        return await asyncio.to_thread(_read_file, source)
+
+    async def send(self, bot: Bot, chat_id: int, source: str, kind: str = 'photo', **kwargs) -> aio_types.Message:
+        """Send ``source`` as ``kind`` (with any ``send_*`` kwargs), uploading it at most once."""
+        send = getattr(bot, SEND_METHODS[kind])
+        cached = self._hot.get(source)
+        if cached is not None:
+            try:
+                return await send(chat_id, cached[1], **kwargs)
+            except TelegramBadRequest as e:
+                if not _stale(e):
+                    raise
+                self._hot.pop(source, None)
+                await db.delete_media_file(cached[0])
+
+        # One upload per asset even if many users hit a cold cache at once
+        async with self._locks.setdefault(source, asyncio.Lock()):
+            if source in self._hot:
+                return await send(chat_id, self._hot[source][1], **kwargs)
+            data = await self._read(bot, source)
+            sha256 = hashlib.sha256(data).hexdigest()
+            file_id = await db.load_media_file(sha256)
+            if file_id is not None:
+                try:
+                    message = await send(chat_id, file_id, **kwargs)
+                    self._hot[source] = (sha256, file_id)
+                    return message
+                except TelegramBadRequest as e:
+                    if not _stale(e):
+                        raise
+                    await db.delete_media_file(sha256)
+            message = await send(
+                chat_id, aio_types.BufferedInputFile(data, filename=os.path.basename(source) or kind), **kwargs
+            )
+            file_id = _file_id(message, kind)
+            await db.save_media_file(sha256, kind, file_id)
+            self._hot[source] = (sha256, file_id)
+            return message
+
+
+def _stale(error: TelegramBadRequest) -> bool:
+    """True if Telegram rejected the file_id itself (new bot token, deleted file)."""
+    if "file" not in error.message.lower():
+        return False
+    logging.warning("Dropping stale file_id: %s", error.message)
+    return True
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+media = TenantLocal(MediaRegistry)
@@ -0,0 +1,257 @@
+import os
+import time
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+import db
+from mtproto import mtproto
+from paid_users import paid_users
+from roles import roles
+from metrics import metrics
+from outbound import BULK, TokenBucket, priority
+from tenants import TenantLocal
+
+# --- Configuration ---
+INTERVAL = float(os.getenv("MEMBERSHIP_INTERVAL", 3600))
+# "warn": tell unpaid members once; "kick": also remove them MEMBERSHIP_GRACE seconds later
+ACTION = os.getenv("MEMBERSHIP_ACTION", "warn")
+GRACE = int(os.getenv("MEMBERSHIP_GRACE", 86400))
+# Removals per second, on top of the Bot API's own limits
+KICK_RATE = float(os.getenv("MEMBERSHIP_KICK_RATE", 1))
+PAGE_SIZE = 200
+LOG_PAGE_SIZE = 100
+# Telegram keeps the admin log for 48 hours; snapshots older than this are rebuilt
+LOG_RETENTION = 47 * 3600
+
+
+# --- MTProto jobs (run by the mtproto workers) ---
+async def _input_channel(manager, channel_id: int):
+    from telethon import utils
+    from telethon.tl.types import PeerChannel
+    client = await manager.client()
+    real_id, _ = utils.resolve_id(channel_id)
+    return await client.get_input_entity(PeerChannel(real_id))
+
+
+def _is_admin(participant) -> bool:
+    from telethon.tl import types as tele_types
+    return isinstance(participant, (tele_types.ChannelParticipantAdmin, tele_types.ChannelParticipantCreator))
+
+
+def _participant_change(participant):
+    """(user_id, is_admin) for a participant, with None for someone no longer in the channel."""
+    from telethon.tl import types as tele_types
+    if isinstance(participant, (tele_types.ChannelParticipantBanned, tele_types.ChannelParticipantLeft)):
+        user_id = getattr(participant.peer, 'user_id', None)
+        if user_id is None:
+            return None
+        gone = isinstance(participant, tele_types.ChannelParticipantLeft) or participant.left \
+            or participant.banned_rights.view_messages
+        return user_id, None if gone else False
+    return participant.user_id, _is_admin(participant)
+
+
+def _event_change(event):
+    from telethon.tl import types as tele_types
+    action = event.action
+    if isinstance(action, (
+        tele_types.ChannelAdminLogEventActionParticipantJoin,
+        tele_types.ChannelAdminLogEventActionParticipantJoinByInvite,
+        tele_types.ChannelAdminLogEventActionParticipantJoinByRequest,
+    )):
+        return event.user_id, False
+    if isinstance(action, tele_types.ChannelAdminLogEventActionParticipantLeave):
+        return event.user_id, None
+    if isinstance(action, tele_types.ChannelAdminLogEventActionParticipantInvite):
+        return _participant_change(action.participant)
+    if isinstance(action, (
+        tele_types.ChannelAdminLogEventActionParticipantToggleBan,
+        tele_types.ChannelAdminLogEventActionParticipantToggleAdmin,
+    )):
+        return _participant_change(action.new_participant)
+    return None
+
+
+async def _admin_log(manager, channel, min_id: int, max_id: int = 0, limit: int = LOG_PAGE_SIZE):
+    from telethon import functions
+    from telethon.tl import types as tele_types
+    result = await manager.call(functions.channels.GetAdminLogRequest(
+        channel=channel, q='', min_id=min_id, max_id=max_id, limit=limit,
+        events_filter=tele_types.ChannelAdminLogEventsFilter(
+            join=True, leave=True, invite=True, ban=True, unban=True, kick=True, unkick=True,
+            promote=True, demote=True
+        )
+    ))
+    return result.events
+
+
+async def full_scan(manager, channel_id: int):
+    """Every member as (user_id, is_admin), and the admin log position to continue from."""
+    from telethon import functions
+    from telethon.tl import types as tele_types
+    channel = await _input_channel(manager, channel_id)
+    # Taken first: events during the scan are replayed next time, which is harmless
+    newest = await _admin_log(manager, channel, 0, limit=1)
+    last_event_id = newest[0].id if newest else 0
+    members, offset = [], 0
+    while True:
+        result = await manager.call(functions.channels.GetParticipantsRequest(
+            channel=channel, filter=tele_types.ChannelParticipantsRecent(), offset=offset, limit=PAGE_SIZE, hash=0
+        ))
+        members += [(p.user_id, _is_admin(p)) for p in result.participants if hasattr(p, 'user_id')]
+        offset += len(result.participants)
+        if not result.participants or offset >= result.count:
+            return members, last_event_id
+
+
+async def log_changes(manager, channel_id: int, after_event_id: int):
+    """Membership changes since ``after_event_id`` as {user_id: is_admin or None}, and the new position."""
+    channel = await _input_channel(manager, channel_id)
+    events, max_id = [], 0
+    while True:
+        # Newest first; page backwards with max_id
+        page = await _admin_log(manager, channel, after_event_id, max_id)
+        events += page
+        if len(page) < LOG_PAGE_SIZE:
+            break
+        max_id = page[-1].id
+    changes = {}
+    for event in sorted(events, key=lambda e: e.id):
+        change = _event_change(event)
+        if change is not None:
+            changes[change[0]] = change[1]
+    return changes, max((e.id for e in events), default=after_event_id)
+
+
+# --- Reconciliation ---
+class MembershipReconciler:
+    """Keeps course channels to paying subscribers.
+
+    Each channel's members are kept in ``channel_members``. The first run (or
+    one after the 48-hour admin log has rolled over) pages through all
+    participants; later runs read only the admin log since the last event
+    seen, so Telegram requests grow with joins and leaves, not channel size.
+    Members without a ``payments`` row are found in SQLite and warned, then
+    removed after ``GRACE`` when ``ACTION`` is "kick".
+    """
+
+    def __init__(self):
+        self._kicks = TokenBucket(KICK_RATE)
+        self._task = None
+        self._bot = None
+
+    async def _sync(self, channel_id: int):
+        state = await db.load_channel_sync(channel_id)
+        now = int(time.time())
+        if state is None or now - state[1] > LOG_RETENTION:
+            members, last_event_id = await mtproto.submit(lambda manager, _: full_scan(manager, channel_id))
+            await db.replace_channel_members(channel_id, members, last_event_id, now)
+            metrics.inc("membership_syncs_total", "full")
+        else:
+            changes, last_event_id = await mtproto.submit(lambda manager, _: log_changes(manager, channel_id, state[0]))
+            await db.apply_channel_changes(channel_id, changes, last_event_id, now)
+            metrics.inc("membership_syncs_total", "log")
+
+    async def _exempt(self, user_id: int) -> bool:
+        # Paid users from the in-memory index cover payments still being committed;
+        # not counted, so paid_index hits/misses stay about /start lookups
+        return paid_users.contains(user_id, count=False) or await roles.is_admin(user_id) or await roles.is_support(user_id)
+
+    async def _kick(self, channel_id: int, user_id: int) -> bool:
+        await self._kicks.acquire()
+        try:
+            await self._bot.ban_chat_member(channel_id, user_id)
+            # Removed, but free to come back through the invite link once they pay
+            await self._bot.unban_chat_member(channel_id, user_id, only_if_banned=True)
+            return True
+        except TelegramAPIError as e:
+            logging.warning("Could not remove %s from %s: %s", user_id, channel_id, e.message)
+            return False
+
+    async def _warn(self, user_id: int, names):
+        courses = ", ".join(f"«{name}»" for name in names)
+        if ACTION == "kick":
+            text = (f"У вас нет активной подписки. Через {GRACE // 3600} ч. доступ к курсам {courses} будет закрыт. "
+                    "Продлите подписку через /start.")
+        else:
+            text = f"Курсы {courses} доступны только по подписке. Оформите её через /start."
+        try:
+            with priority(BULK):
+                await self._bot.send_message(user_id, text)
+        except TelegramAPIError as e:
+            logging.warning("Could not warn %s: %s", user_id, e.message)
+
+    async def reconcile(self):
+        now = int(time.time())
+        kicking = ACTION == "kick"
+        # Warned long enough ago to be removed now; -1 never matches, so nobody is warned twice
+        warned_before = now - GRACE if kicking else -1
+        # Several courses may share a channel
+        channels = {}
+        for _, name, _, channel in await db.load_courses():
+            try:
+                channels.setdefault(int(channel), []).append(name)
+            except (TypeError, ValueError):
+                logging.warning("Course %s has no valid channel id: %r", name, channel)
+        warnings = {}
+        kicked = 0
+        for channel_id, names in channels.items():
+            try:
+                await self._sync(channel_id)
+            except asyncio.QueueFull:
+                logging.warning("MTProto queue is full, membership check postponed")
+                return
+            except Exception:
+                logging.exception("Could not sync members of %s", channel_id)
+                continue
+
+            await db.clear_paid_warnings(channel_id)
+            warned, removed = [], []
+            for user_id, warned_at in await db.load_unpaid_members(channel_id, warned_before):
+                if await self._exempt(user_id):
+                    continue
+                if warned_at is None and (not kicking or GRACE > 0):
+                    warnings.setdefault(user_id, []).extend(names)
+                    warned.append(user_id)
+                elif kicking and await self._kick(channel_id, user_id):
+                    removed.append(user_id)
+            if warned:
+                await db.mark_members_warned(channel_id, warned, now)
+            if removed:
+                await db.remove_channel_members(channel_id, removed)
+                kicked += len(removed)
+
+        for user_id, names in warnings.items():
+            await self._warn(user_id, names)
+        metrics.inc("membership_actions_total", "warned", len(warnings))
+        metrics.inc("membership_actions_total", "kicked", kicked)
+        if warnings or kicked:
+            logging.info("Membership check: %d warned, %d removed", len(warnings), kicked)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception:
+                logging.exception("Membership check failed")
+            await asyncio.sleep(INTERVAL)
+
+    def start(self, bot: Bot):
+        self._bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+membership = TenantLocal(MembershipReconciler)
@@ -0,0 +1,173 @@
+import os
+import time
+import logging
+from bisect import bisect_left
+
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# --- Configuration ---
+# Port for the Prometheus endpoint, 0 disables it
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+
+# Latency buckets in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    """Labelled histograms and counters, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name: str, label: str, value: float):
+        family = self.histograms.setdefault(name, {})
+        histogram = family.get(label)
+        if histogram is None:
+            histogram = family[label] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name: str, label: str, amount: int = 1):
+        family = self.counters.setdefault(name, {})
+        family[label] = family.get(label, 0) + amount
+
+    def gauge(self, name: str, fn):
+        """Register ``fn()`` returning ``{label: value}``, read at render time."""
+        self.gauges[name] = fn
+
+    def render(self) -> str:
+        lines = []
+        for name, family in self.histograms.items():
+            lines.append(f"# TYPE {name} histogram")
+            for label, h in family.items():
+                cumulative = 0
+                for bound, n in zip(h.buckets, h.counts):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{{name="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{name="{label}",le="+Inf"}} {h.count}')
+                lines.append(f'{name}_sum{{name="{label}"}} {h.sum}')
+                lines.append(f'{name}_count{{name="{label}"}} {h.count}')
+        for name, family in self.counters.items():
+            lines.append(f"# TYPE {name} counter")
+            for label, value in family.items():
+                lines.append(f'{name}{{name="{label}"}} {value}')
+        for name, fn in self.gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            for label, value in fn().items():
+                lines.append(f'{name}{{name="{label}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self, name: str, limit: int = 10) -> str:
+        family = self.histograms.get(name, {})
+        rows = sorted(family.items(), key=lambda item: item[1].count, reverse=True)[:limit]
+        return "\n".join(
+            f"{label}: n={h.count} avg={h.sum / h.count * 1000:.1f}ms "
+            f"p95≤{h.quantile(0.95) * 1000:.0f}ms"
+            for label, h in rows
+        )
+
+
+metrics = Metrics()
+
+
+# --- Instrumentation ---
+class UpdateTimer(BaseMiddleware):
+    """Outer middleware: total time per update, by update type."""
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            metrics.observe("bot_update_seconds", event.event_type, time.perf_counter() - started)
+
+
+class HandlerTimer(BaseMiddleware):
+    """Inner middleware: runs once a handler is chosen, so it knows its name."""
+
+    async def __call__(self, handler, event, data):
+        name = data['handler'].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.inc("bot_handler_errors_total", name)
+            raise
+        finally:
+            metrics.observe("bot_handler_seconds", name, time.perf_counter() - started)
+
+
+class ApiTimer(BaseRequestMiddleware):
+    """Session middleware timing every outbound Bot API call."""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            metrics.inc("bot_api_errors_total", name)
+            raise
+        finally:
+            metrics.observe("bot_api_seconds", name, time.perf_counter() - started)
+
+
+def observe_query(name: str, seconds: float):
+    metrics.observe("db_query_seconds", name.lstrip('_'), seconds)
+
+
+def install(dp: Dispatcher, bots: "list[Bot]", pool):
+    dp.update.outer_middleware(UpdateTimer())
+    for event_name, observer in dp.observers.items():
+        if event_name not in ('update', 'error'):
+            observer.middleware(HandlerTimer())
+    for bot in bots:
+        bot.session.middleware(ApiTimer())
+    pool.on_query = observe_query
+
+
+# --- HTTP endpoint ---
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+
+async def serve(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """Start the /metrics server; returns the runner to clean up, or None if disabled."""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Metrics available on %s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,306 @@
+"""Versioned schema migrations.
+
+Each migration runs once, in its own transaction, and bumps the single row in
+``schema_version``. On an up-to-date database ``migrate`` is one SELECT.
+Databases created before versioning start at 0; the early migrations use
+``IF NOT EXISTS`` and column checks so they apply cleanly over such a schema.
+Append new migrations to ``MIGRATIONS``; never edit one that has shipped.
+"""
+import sqlite3
+
+
+def _columns(conn, table: str) -> set:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _v1_initial(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS courses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            url TEXT UNIQUE NOT NULL,
+            channel_id TEXT NOT NULL DEFAULT '-1002519961960'
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE NOT NULL,
+            paid_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE NOT NULL,
+            first_name TEXT,
+            last_name TEXT,
+            username TEXT,
+            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS support (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE NOT NULL
+        )
+        """
+    )
+    # Seed default courses
+    if conn.execute("SELECT COUNT(*) FROM courses").fetchone()[0] == 0:
+        conn.executemany(
+            "INSERT INTO  courses (name, url) VALUES (?, ?)",
+            [("Экспресс-грамматика", "https://t.me/+uKg4xGQ0MDtkMTBi"), ("Путешествия", "https://t.me/+umKj0R00Rb9jNzE6")]
+        )
+
+
+def _v2_admin_and_broadcasts(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS admin (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            admin_chat_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_targets (
+            broadcast_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            PRIMARY KEY (broadcast_id, chat_id)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _v3_fsm_storage(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated_at ON fsm_storage (updated_at)")
+
+
+def _v4_payment_ledger(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payment_ledger (
+            telegram_payment_charge_id TEXT PRIMARY KEY,
+            provider_payment_charge_id TEXT,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            period_days INTEGER NOT NULL,
+            payload TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_payment_ledger_user_id ON payment_ledger (user_id)")
+
+
+def _v5_subscription_expiry(conn):
+    # expires_at is a unix timestamp; NULL (rows from before expiry existed) never expires
+    columns = _columns(conn, "payments")
+    if "expires_at" not in columns:
+        conn.execute("ALTER TABLE payments ADD COLUMN expires_at INTEGER")
+    if "reminded" not in columns:
+        conn.execute("ALTER TABLE payments ADD COLUMN reminded INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_expires_at ON payments (expires_at, user_id)")
+
+
+def _v6_receipt_checks(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS receipt_checks (
+            sha256 TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            ok INTEGER NOT NULL,
+            amount INTEGER,
+            reason TEXT,
+            checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+def _v7_courses_fts(conn):
+    # External-content index over courses.name, kept in sync by triggers
+    conn.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS courses_fts USING fts5(
+            name,
+            content='courses',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS courses_fts_insert AFTER INSERT ON courses BEGIN
+            INSERT INTO courses_fts (rowid, name) VALUES (new.id, new.name);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS courses_fts_delete AFTER DELETE ON courses BEGIN
+            INSERT INTO courses_fts (courses_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS courses_fts_update AFTER UPDATE OF name ON courses BEGIN
+            INSERT INTO courses_fts (courses_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO courses_fts (rowid, name) VALUES (new.id, new.name);
+        END
+        """
+    )
+    conn.execute("INSERT INTO courses_fts (courses_fts) VALUES ('rebuild')")
+
+
+def _v8_media_files(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS media_files (
+            sha256 TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+def _v9_channel_members(conn):
+    # Last known members of each course channel, see membership.py
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS channel_members (
+            channel_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            is_admin INTEGER NOT NULL DEFAULT 0,
+            warned_at INTEGER,
+            PRIMARY KEY (channel_id, user_id)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS channel_sync (
+            channel_id INTEGER PRIMARY KEY,
+            last_event_id INTEGER NOT NULL,
+            synced_at INTEGER NOT NULL
+        )
+        """
+    )
+
+
+def _v10_receipt_consumed(conn):
+    # Set when a receipt is credited; a receipt pays for one subscription only
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(receipt_checks)")}
+    if "consumed_at" not in columns:
+        conn.execute("ALTER TABLE receipt_checks ADD COLUMN consumed_at INTEGER")
+    conn.execute(
+        "UPDATE receipt_checks SET consumed_at = CAST(strftime('%s', 'now') AS INTEGER) "
+        "WHERE consumed_at IS NULL AND 'kaspi:' || sha256 IN (SELECT telegram_payment_charge_id FROM payment_ledger)"
+    )
+
+
+def _v11_payment_dead_letters(conn):
+    # Confirmations the ledger could not commit, kept for manual repair;
+    # no constraints, since bad data is the usual reason they are here
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payment_dead_letters (
+            telegram_payment_charge_id TEXT,
+            provider_payment_charge_id TEXT,
+            user_id INTEGER,
+            amount INTEGER,
+            currency TEXT,
+            period_days INTEGER,
+            payload TEXT,
+            error TEXT,
+            failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+MIGRATIONS = [
+    (1, _v1_initial),
+    (2, _v2_admin_and_broadcasts),
+    (3, _v3_fsm_storage),
+    (4, _v4_payment_ledger),
+    (5, _v5_subscription_expiry),
+    (6, _v6_receipt_checks),
+    (7, _v7_courses_fts),
+    (8, _v8_media_files),
+    (9, _v9_channel_members),
+    (10, _v10_receipt_consumed),
+    (11, _v11_payment_dead_letters),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+def current_version(conn) -> int:
+    try:
+        row = conn.execute("SELECT version FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+
+def migrate(conn) -> int:
+    """Bring the database up to ``LATEST`` and return the version it was at."""
+    start = current_version(conn)
+    if start >= LATEST:
+        return start
+    for version, migration in MIGRATIONS:
+        # BEGIN IMMEDIATE takes the write lock, so of two processes starting
+        # at once only one applies each migration
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+            if current_version(conn) >= version:
+                conn.rollback()
+                continue
+            migration(conn)
+            conn.execute("DELETE FROM schema_version")
+            conn.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return start
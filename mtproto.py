@@ -0,0 +1,117 @@
+import os
+import asyncio
+import logging
+
+from dotenv import load_dotenv
+
+# --- Load environment variables from .env ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(os.path.join(BASE_DIR, '.env'))
+
+# --- Configuration ---
+API_ID = os.getenv("APP-API-ID")
+API_HASH = os.getenv("APP-API-HASH")
+SESSION_PATH = os.path.join(BASE_DIR, 'session')
+QUEUE_SIZE = int(os.getenv("MTPROTO_QUEUE_SIZE", 16))
+WORKERS = int(os.getenv("MTPROTO_WORKERS", 1))
+# Flood waits longer than this fail the job instead of stalling the queue
+MAX_FLOOD_WAIT = int(os.getenv("MTPROTO_MAX_FLOOD_WAIT", 300))
+
+
+async def _no_progress(text: str):
+    pass
+
+
+class MTProtoManager:
+    """One long-lived Telethon client shared by every caller.
+
+    Slow multi-request jobs (channel provisioning and the like) go through a
+    bounded queue served by ``WORKERS`` tasks, so concurrent admins never open
+    the session file twice and flood waits are handled in one place.
+    """
+
+    def __init__(self, session: str, api_id, api_hash):
+        self.session = session
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self._client = None
+        self._lock = asyncio.Lock()
+        self._queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self._workers = []
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_id and self.api_hash)
+
+    async def client(self):
+        if self._client is not None and self._client.is_connected():
+            return self._client
+        async with self._lock:
+            if self._client is None:
+                # Imported on first use so bots without MTProto never load Telethon
+                from telethon import TelegramClient
+                # Flood waits are handled by call() so they can be reported
+                self._client = TelegramClient(
+                    session=self.session,
+                    api_id=int(self.api_id),
+                    api_hash=self.api_hash,
+                    flood_sleep_threshold=0
+                )
+            if not self._client.is_connected():
+                await self._client.start()
+        return self._client
+
+    async def call(self, request, progress=_no_progress):
+        from telethon import errors
+        client = await self.client()
+        while True:
+            try:
+                return await client(request)
+            except errors.FloodWaitError as e:
+                if e.seconds > MAX_FLOOD_WAIT:
+                    raise
+                await progress(f"⏳ Telegram просит подождать {e.seconds} с.")
+                await asyncio.sleep(e.seconds + 1)
+
+    async def submit(self, job, progress=_no_progress):
+        """Queue ``job(manager, progress)`` and wait for its result.
+
+        Raises ``asyncio.QueueFull`` when the queue is at capacity.
+        """
+        if not self._workers:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((job, progress, future))
+        if self._queue.qsize() > 1:
+            await progress(f"🕒 Задача в очереди, позиция {self._queue.qsize()}")
+        return await future
+
+    async def _worker(self):
+        while True:
+            job, progress, future = await self._queue.get()
+            try:
+                if not future.cancelled():
+                    future.set_result(await job(self, progress))
+            except Exception as e:
+                logging.exception("MTProto job failed")
+                if not future.cancelled():
+                    future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    async def start(self):
+        await self.client()
+        while len(self._workers) < WORKERS:
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._client is not None:
+            await self._client.disconnect()
+            self._client = None
+
+
+mtproto = MTProtoManager(SESSION_PATH, API_ID, API_HASH)
@@ -0,0 +1,216 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import contextvars
+from contextlib import asynccontextmanager, contextmanager
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramRetryAfter
+
+from metrics import metrics
+
+# --- Telegram limits ---
+# ~30 messages/s overall, 1/s into one private chat, 20/min into one group or channel
+GLOBAL_RATE = float(os.getenv("OUTBOUND_RATE", 30))
+PRIVATE_CHAT_RATE = 1.0
+GROUP_CHAT_RATE = 20 / 60
+# Short per-chat bursts are tolerated, e.g. "checking…" followed by the answer
+CHAT_BURST = 3
+# Bulk calls may hold at most this many connections, the rest stay free for users
+BULK_CONCURRENCY = int(os.getenv("OUTBOUND_BULK_CONCURRENCY", 10))
+CONNECTIONS = int(os.getenv("OUTBOUND_CONNECTIONS", 100))
+KEEPALIVE = float(os.getenv("OUTBOUND_KEEPALIVE", 60))
+
+# --- Priority classes ---
+PAYMENTS, INTERACTIVE, BULK = 0, 1, 2
+PRIORITY_NAMES = ('payments', 'interactive', 'bulk')
+
+_priority = contextvars.ContextVar('outbound_priority', default=INTERACTIVE)
+
+# Always scheduled as PAYMENTS, whoever sends them
+PAYMENT_METHODS = {'SendInvoice', 'CreateInvoiceLink', 'AnswerPreCheckoutQuery', 'AnswerShippingQuery'}
+# Calls that count against the message limits; everything else (getUpdates,
+# answerCallbackQuery, answerPreCheckoutQuery, getFile…) is sent right away
+RATE_LIMITED = {
+    'SendMessage', 'SendPhoto', 'SendDocument', 'SendVideo', 'SendAudio', 'SendAnimation',
+    'SendVoice', 'SendVideoNote', 'SendMediaGroup', 'SendSticker', 'SendLocation',
+    'SendContact', 'SendPoll', 'SendDice', 'SendInvoice', 'CopyMessage', 'CopyMessages',
+    'ForwardMessage', 'ForwardMessages', 'EditMessageText', 'EditMessageCaption',
+    'EditMessageMedia', 'EditMessageReplyMarkup',
+}
+
+
+@contextmanager
+def priority(level: int):
+    """Send every Bot API call made inside the block with ``level``."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class OutboundScheduler:
+    """Hands out Bot API send slots under Telegram's limits, by priority.
+
+    Each call first waits for its chat's bucket, then for a token from the
+    global bucket. When the global bucket is empty callers queue in a heap
+    ordered by priority class, so a payment or a reply to a user overtakes
+    any number of queued broadcast messages.
+    """
+
+    def __init__(self, rate: float = GLOBAL_RATE, bulk_concurrency: int = BULK_CONCURRENCY):
+        self.bucket = TokenBucket(rate, capacity=rate)
+        self._chat_buckets = {}
+        # (priority, seq, future)
+        self._waiters = []
+        self._seq = itertools.count()
+        self._task = None
+        self._bulk = asyncio.Semaphore(bulk_concurrency)
+        self.waiting = [0] * len(PRIORITY_NAMES)
+        self.in_flight = [0] * len(PRIORITY_NAMES)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            private = isinstance(chat_id, int) and chat_id > 0
+            bucket = TokenBucket(PRIVATE_CHAT_RATE if private else GROUP_CHAT_RATE, capacity=CHAT_BURST)
+            self._chat_buckets[chat_id] = bucket
+            if len(self._chat_buckets) > 10000:
+                # A full bucket carries no state, so dropping it keeps the table small
+                self._chat_buckets = {k: b for k, b in self._chat_buckets.items() if not b.idle}
+        return bucket
+
+    def pause(self, seconds: float):
+        """Flood control applies to the whole bot: hold every queued call."""
+        self.bucket.pause(seconds)
+
+    async def _dispatch(self):
+        while self._waiters:
+            await self.bucket.acquire()
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    break
+            else:
+                # Every waiter gave up; keep the token
+                self.bucket.tokens += 1
+        self._task = None
+
+    async def _acquire_global(self, level: int):
+        if not self._waiters and self.bucket.try_acquire():
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (level, next(self._seq), future))
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+        await future
+
+    @asynccontextmanager
+    async def slot(self, level: int, chat_id=None):
+        started = time.monotonic()
+        self.waiting[level] += 1
+        try:
+            if level == BULK:
+                await self._bulk.acquire()
+            try:
+                if chat_id is not None:
+                    await self._chat_bucket(chat_id).acquire()
+                await self._acquire_global(level)
+            except BaseException:
+                if level == BULK:
+                    self._bulk.release()
+                raise
+        finally:
+            self.waiting[level] -= 1
+        metrics.observe("outbound_wait_seconds", PRIORITY_NAMES[level], time.monotonic() - started)
+        self.in_flight[level] += 1
+        try:
+            yield
+        finally:
+            self.in_flight[level] -= 1
+            if level == BULK:
+                self._bulk.release()
+
+    def depths(self) -> dict:
+        stats = {f"{name}_waiting": n for name, n in zip(PRIORITY_NAMES, self.waiting)}
+        stats.update({f"{name}_in_flight": n for name, n in zip(PRIORITY_NAMES, self.in_flight)})
+        return stats
+
+
+class OutboundSession(AiohttpSession):
+    """aiohttp session that sends rate-limited calls through the scheduler.
+
+    All calls share one keep-alive connection pool of ``CONNECTIONS`` sockets.
+    """
+
+    def __init__(self, scheduler: OutboundScheduler = None, limit: int = CONNECTIONS,
+                 keepalive: float = KEEPALIVE, **kwargs):
+        super().__init__(limit=limit, **kwargs)
+        self._connector_init["keepalive_timeout"] = keepalive
+        self.scheduler = scheduler or outbound
+
+    async def make_request(self, bot: Bot, method, timeout=None):
+        name = type(method).__name__
+        try:
+            if name not in RATE_LIMITED:
+                return await super().make_request(bot, method, timeout)
+            level = PAYMENTS if name in PAYMENT_METHODS else _priority.get()
+            # Editing a message already in the chat is not held to the per-chat rate
+            chat_id = None if name.startswith('Edit') else getattr(method, 'chat_id', None)
+            async with self.scheduler.slot(level, chat_id):
+                return await super().make_request(bot, method, timeout)
+        except TelegramRetryAfter as e:
+            self.scheduler.pause(e.retry_after)
+            raise
+
+
+outbound = OutboundScheduler()
+metrics.gauge("outbound_queue", outbound.depths)
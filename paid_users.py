@@ -0,0 +1,88 @@
+import os
+import heapq
+from array import array
+from bisect import bisect_left
+
+from tenants import TenantLocal
+
+# Recent additions wait in a small set before being merged into the sorted array
+MERGE_THRESHOLD = 1024
+
+
+class PaidUserIndex:
+    """Memory-resident set of paid user IDs.
+
+    The default mode is a plain ``set``. Compact mode keeps the IDs in a sorted
+    ``array('q')`` (8 bytes per user) and looks them up with bisect, which keeps
+    hundreds of thousands of subscribers in a few megabytes.
+    """
+
+    def __init__(self, compact: bool = False):
+        self.compact = compact
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+        self._ids = array('q') if compact else set()
+        self._pending = set()
+
+    def load(self, sorted_ids: array):
+        if self.compact:
+            self._ids = sorted_ids
+        else:
+            self._ids = set(sorted_ids)
+        self._pending = set()
+        self.loaded = True
+
+    def _in_array(self, user_id: int) -> bool:
+        i = bisect_left(self._ids, user_id)
+        return i < len(self._ids) and self._ids[i] == user_id
+
+    def _merge(self):
+        self._ids = array('q', heapq.merge(self._ids, sorted(self._pending)))
+        self._pending = set()
+
+    def add(self, user_id: int):
+        if not self.compact:
+            self._ids.add(user_id)
+        elif not self._in_array(user_id):
+            self._pending.add(user_id)
+            if len(self._pending) >= MERGE_THRESHOLD:
+                self._merge()
+
+    def discard(self, user_id: int):
+        if not self.compact:
+            self._ids.discard(user_id)
+        elif user_id in self._pending:
+            self._pending.discard(user_id)
+        elif self._in_array(user_id):
+            del self._ids[bisect_left(self._ids, user_id)]
+
+    def contains(self, user_id: int, count: bool = True) -> bool:
+        """Membership test; ``count=False`` leaves the hit/miss counters alone."""
+        if self.compact:
+            found = user_id in self._pending or self._in_array(user_id)
+        else:
+            found = user_id in self._ids
+        if count:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return found
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.contains(user_id)
+
+    def __len__(self):
+        return len(self._ids) + len(self._pending)
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'compact': self.compact,
+        }
+
+
+paid_users = TenantLocal(lambda: PaidUserIndex(compact=os.getenv("PAID_INDEX_COMPACT", "0") == "1"))
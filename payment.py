@@ -7,16 +7,18 @@ from aiogram.types.message import ContentType
 import os
 from aiogram.fsm.state import State, StatesGroup
 
-import db
-
-logging.basicConfig(
-    level=logging.INFO
-)
+import tenants
+from ledger import ledger
 
 PROVIDER_TOKEN = os.getenv("PROVIDER_TOKEN")  # from BotFather
 CURRENCY       = "KZT"                        # or "USD", "EUR", etc.
 
 PRICE = types.LabeledPrice(label="Подписка на 1 месяц", amount=1000*100)  # в копейках (руб)
+SUBSCRIPTION_DAYS = 30
+# sendInvoice only takes a URL (no file_id), and Telegram caches it on its side
+INVOICE_PHOTO_URL = os.getenv(
+    "INVOICE_PHOTO_URL", "https://www.aroged.com/wp-content/uploads/2022/06/Telegram-has-a-premium-subscription.jpg"
+)
 
 class PaymentState(StatesGroup):
     awaiting_payment = State()
@@ -25,15 +27,17 @@ class PaymentState(StatesGroup):
 
 async def payment_handler(query: CallbackQuery, bot: Bot):
     message = query.message
-    if PROVIDER_TOKEN.split(':')[1] == 'TEST':
+    # Each tenant may have its own payment provider, see tenants.setting
+    provider_token = tenants.setting("PROVIDER_TOKEN", PROVIDER_TOKEN)
+    if provider_token.split(':')[1] == 'TEST':
         await bot.send_message(message.chat.id, "Тестовый платеж!!!")
 
     await bot.send_invoice(message.chat.id,
                            title="Подписка на бота",
                            description="Активация подписки на бота на 1 месяц",
-                           provider_token=PROVIDER_TOKEN,
+                           provider_token=provider_token,
                            currency= CURRENCY,
-                           photo_url="https://www.aroged.com/wp-content/uploads/2022/06/Telegram-has-a-premium-subscription.jpg",
+                           photo_url=tenants.setting("INVOICE_PHOTO_URL", INVOICE_PHOTO_URL),
                            photo_width=416,
                            photo_height=234,
                            photo_size=416,
@@ -49,20 +53,24 @@ async def pre_checkout_query(pre_checkout_q: types.PreCheckoutQuery, bot: Bot):
 
 # successful payment
 async def successful_payment(message: types.Message, bot: Bot):
-    print("SUCCESSFUL PAYMENT:")
-    db.update_record_payment(int(message.from_user.id))
-    payment_info = message.successful_payment.dict()
-    for k, v in payment_info.items():
-        print(f"{k} = {v}")
+    paid = message.successful_payment
+    ledger.submit((
+        paid.telegram_payment_charge_id,
+        paid.provider_payment_charge_id,
+        int(message.from_user.id),
+        paid.total_amount,
+        paid.currency,
+        SUBSCRIPTION_DAYS,
+        paid.invoice_payload
+    ))
+    logging.info("Successful payment %s from user %s", paid.telegram_payment_charge_id, message.from_user.id)
     await bot.send_message(message.chat.id,
                            f"Платеж на сумму {message.successful_payment.total_amount // 100} {message.successful_payment.currency} прошел успешно!!!")
 
 #refunded payment
 async def refund_payment(message: types.Message, bot: Bot):
-    print ("REFUND PAYMENT:")
-    payment_info = message.refund_payment.dict()
-    for k, v in payment_info.items():
-        print(f"{k} = {v}")
+    refunded = message.refunded_payment
+    logging.info("Refunded payment %s from user %s", refunded.telegram_payment_charge_id, message.from_user.id)
 
     await bot.send_message(message.chat.id,
-                           f"Платеж на сумму {message.successful_payment.total_amount // 100} {message.successful_payment.currency} возвращен!!!")
+                           f"Платеж на сумму {refunded.total_amount // 100} {refunded.currency} возвращен!!!")
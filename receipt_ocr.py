@@ -0,0 +1,56 @@
+"""OCR of Kaspi receipts, run inside worker processes.
+
+Kept free of aiogram and the database so worker processes import nothing
+but the imaging libraries.
+"""
+import re
+
+import pytesseract
+from PIL import Image
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+OCR_LANG = "rus+eng"
+PDF_DPI = 200
+
+# "1 000 ₸", "1000,00 тг", "1 000.00 KZT"; OCR often reads ₸ as T
+AMOUNT_RE = re.compile(
+    r"(\d{1,3}(?:[ \u00a0]\d{3})+|\d+)(?:[.,]\d{1,2})?\s*(?:₸|тг|kzt|t\b|т\b)",
+    re.IGNORECASE
+)
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", "", text).lower()
+
+
+def parse_amounts(text: str) -> set:
+    return {int(re.sub(r"\D", "", m.group(1))) for m in AMOUNT_RE.finditer(text)}
+
+
+def _pages(path: str):
+    """Yield one page image at a time; PDF pages are rendered only when reached."""
+    if path.lower().endswith(".pdf"):
+        for page in range(1, pdfinfo_from_path(path)["Pages"] + 1):
+            yield convert_from_path(path, dpi=PDF_DPI, first_page=page, last_page=page)[0]
+    else:
+        with Image.open(path) as image:
+            yield image
+
+
+def ocr_receipt(path: str, expected_amount: int, recipient: str) -> dict:
+    amounts = set()
+    # No recipient to look for is a failed check, not a pass
+    recipient_found = False
+    pages = 0
+    for image in _pages(path):
+        pages += 1
+        text = pytesseract.image_to_string(image, lang=OCR_LANG)
+        amounts |= parse_amounts(text)
+        recipient_found = recipient_found or bool(recipient) and _normalize(recipient) in _normalize(text)
+        if expected_amount in amounts and recipient_found:
+            break
+    return {
+        'amounts': sorted(amounts),
+        'recipient_found': recipient_found,
+        'pages': pages,
+    }
@@ -0,0 +1,69 @@
+import os
+import asyncio
+import logging
+
+from aiogram import types as aio_types
+
+import db
+from tenants import TenantLocal
+
+# Flush when this many new users are queued, or after this many seconds
+FLUSH_SIZE = int(os.getenv("USER_FLUSH_SIZE", 500))
+FLUSH_INTERVAL = float(os.getenv("USER_FLUSH_INTERVAL", 2.0))
+
+
+class UserWriteBehind:
+    """Queues new users in memory and inserts them in batched transactions."""
+
+    def __init__(self, flush_size: int = FLUSH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._seen = set()
+        self._pending = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def add(self, user: aio_types.User):
+        if user.id in self._seen:
+            return
+        self._seen.add(user.id)
+        self._pending[user.id] = (user.id, user.first_name, user.last_name, user.username)
+        if len(self._pending) >= self.flush_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        rows, self._pending = list(self._pending.values()), {}
+        try:
+            await db.save_new_users(rows)
+        except Exception:
+            logging.exception("Failed to save %d users, will retry", len(rows))
+            for row in rows:
+                self._pending.setdefault(row[0], row)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+registrations = TenantLocal(UserWriteBehind)
@@ -0,0 +1,52 @@
+import os
+import time
+import asyncio
+
+import db
+from tenants import TenantLocal
+
+# Admins are edited straight in SQLite, so the cache is also refreshed after
+# this many seconds without any write from the bot.
+ROLE_CACHE_TTL = float(os.getenv("ROLE_CACHE_TTL", 300))
+
+
+class RoleCache:
+    """In-memory admin/support membership, reloaded on TTL expiry or when
+    ``db.roles_version`` moves."""
+
+    def __init__(self, ttl: float = ROLE_CACHE_TTL):
+        self.ttl = ttl
+        self._admins = frozenset()
+        self._support = frozenset()
+        self._version = -1
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _fresh(self) -> bool:
+        return self._version == db.roles_version and time.monotonic() < self._expires_at
+
+    async def refresh(self):
+        if self._fresh():
+            return
+        async with self._lock:
+            if self._fresh():
+                return
+            version = db.roles_version
+            self._admins, self._support = await db.load_roles()
+            self._version = version
+            self._expires_at = time.monotonic() + self.ttl
+
+    async def is_admin(self, user_id: int) -> bool:
+        await self.refresh()
+        return user_id in self._admins
+
+    async def is_support(self, user_id: int) -> bool:
+        await self.refresh()
+        return user_id in self._support
+
+    async def support_ids(self) -> frozenset:
+        await self.refresh()
+        return self._support
+
+
+roles = TenantLocal(RoleCache)
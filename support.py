@@ -9,8 +9,9 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
 import db
-from db import load_support, add_support
 from courses import ButtonStates
+from roles import roles
+from tickets import tickets, Ticket
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'courses.db')
@@ -22,8 +23,7 @@ class SupportForm(StatesGroup):
 async def support_handler(query: aio_types.CallbackQuery, state: FSMContext):
     message = query.message
     user_id = message.chat.id
-    print(user_id)
-    if db.not_admin(user_id):
+    if not await roles.is_admin(user_id):
         await support_entry(message, state)
     else:
         kb = [
@@ -35,31 +35,52 @@ async def support_handler(query: aio_types.CallbackQuery, state: FSMContext):
         await message.answer(text="Выберите действие", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
         await state.clear()
         await state.set_state(ButtonStates.main_page)
-        await query.answer()
 
 async def support_entry(message: aio_types.Message, state: FSMContext):
     await message.answer("Напишите свое сообщение техподдержке:")
     await state.set_state(SupportForm.message)
 
-async def support_message_handler(message: aio_types.Message, state: FSMContext, bot: Bot):
-    CURATOR_CHAT_ID = db.load_support()
-    await bot.forward_message(
-        chat_id=CURATOR_CHAT_ID,
+async def forward_to_curator(message: aio_types.Message, bot: Bot) -> bool:
+    ticket = await tickets.open(message.from_user.id)
+    if ticket is None:
+        return False
+    forwarded = await bot.forward_message(
+        chat_id=ticket.curator_id,
         from_chat_id=message.from_user.id,
         message_id=message.message_id
     )
-    await message.answer("Ваше сообщение отправлено, наш куратор скоро ответит.")
+    tickets.track(ticket, forwarded.message_id)
+    return True
+
+async def support_message_handler(message: aio_types.Message, state: FSMContext, bot: Bot):
     await state.clear()
+    if await forward_to_curator(message, bot):
+        await message.answer("Ваше сообщение отправлено, наш куратор скоро ответит.")
+    else:
+        await message.answer("Техподдержка сейчас недоступна, попробуйте позже.")
+
+async def curator_reply_handler(message: aio_types.Message, ticket: Ticket, bot: Bot):
+    await bot.copy_message(
+        chat_id=ticket.user_id,
+        from_chat_id=message.chat.id,
+        message_id=message.message_id
+    )
+    tickets.answered(ticket)
+
+async def close_ticket_handler(message: aio_types.Message, ticket: Ticket, bot: Bot):
+    tickets.close(ticket.user_id)
+    await bot.send_message(ticket.user_id, "Обращение закрыто. Если появятся вопросы, снова напишите в техподдержку.")
+    await message.answer("✅ Обращение закрыто.")
 
 async def add_support(message: aio_types.Message):
-    db.add_support(message.chat.id)
+    await db.add_support(message.chat.id)
 
     await message.answer(f"user {message.from_user.id} was added to support.")
 
 async def delete_support(message: aio_types.Message):
-    db.delete_support(message.chat.id)
+    await db.delete_support(message.chat.id)
     await message.answer(f"user {message.from_user.id} was removed from support.")
 
 async def get_support():
-    return db.get_support()
+    return await db.get_support()
 
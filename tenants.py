@@ -0,0 +1,216 @@
+"""Multi-tenant mode: several bots served by one process.
+
+Tenants are listed in ``TENANTS_FILE``, a JSON list of objects with ``name``,
+``token``, and optionally ``db`` (SQLite path, default
+``tenants/<name>.db``) and ``env`` (per-tenant settings, default
+``tenants/<name>.env``). All tenants share the event loop, the dispatcher and
+the database thread pool; each has its own database file.
+
+The tenant an update belongs to is kept in a context variable for the
+duration of the update, and everything tenant-specific resolves through it:
+``db.pool`` picks the tenant's database, ``TenantLocal`` singletons (paid
+users, roles, catalog…) hand out one instance per tenant, and ``setting``
+reads the tenant's own config. Without ``TENANTS_FILE`` there is no tenant
+and everything behaves as a single bot.
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram import Bot, Dispatcher
+from dotenv import dotenv_values
+
+import migrations
+from db_pool import PRAGMAS
+from metrics import metrics
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TENANTS_FILE = os.getenv("TENANTS_FILE", "")
+TENANTS_DIR = os.path.join(BASE_DIR, 'tenants')
+
+current = ContextVar('tenant', default=None)
+
+
+class Tenant:
+    def __init__(self, name: str, token: str, db_path: str = None, env_path: str = None):
+        self.name = name
+        self.token = token
+        self.bot_id = int(token.split(':')[0])
+        self.db_path = db_path or os.path.join(TENANTS_DIR, f"{name}.db")
+        self.env_path = env_path or os.path.join(TENANTS_DIR, f"{name}.env")
+        self._config = None
+
+    @property
+    def config(self) -> dict:
+        # Read on first use, so idle tenants cost nothing at startup
+        if self._config is None:
+            self._config = dotenv_values(self.env_path) if os.path.exists(self.env_path) else {}
+        return self._config
+
+    def migrate(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            migrations.migrate(conn)
+        finally:
+            conn.close()
+
+
+def _load(path: str) -> dict:
+    if not path:
+        return {}
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+    loaded = {}
+    for entry in entries:
+        tenant = Tenant(entry['name'], entry['token'], entry.get('db'), entry.get('env'))
+        loaded[tenant.bot_id] = tenant
+    return loaded
+
+
+# bot id -> Tenant
+registry = _load(TENANTS_FILE)
+
+
+def enabled() -> bool:
+    return bool(registry)
+
+
+def get() -> "Tenant | None":
+    return current.get()
+
+
+@contextmanager
+def use(tenant: "Tenant | None"):
+    token = current.set(tenant)
+    try:
+        yield tenant
+    finally:
+        current.reset(token)
+
+
+def use_bot(bot_id: int):
+    return use(registry.get(bot_id))
+
+
+def db_path():
+    """Database of the current tenant, or None for the default one."""
+    tenant = current.get()
+    return tenant.db_path if tenant is not None else None
+
+
+def setting(name: str, default=None):
+    """The current tenant's value for ``name``, falling back to ``default``."""
+    tenant = current.get()
+    if tenant is not None:
+        value = tenant.config.get(name)
+        if value is not None:
+            return value
+    return default
+
+
+# --- Per-tenant singletons ---
+_locals = []
+
+
+class TenantLocal:
+    """Stands in for a module-level singleton, with one instance per tenant.
+
+    Attribute access is forwarded to the current tenant's instance, created
+    by ``factory()`` on first use. Background tasks started from a tenant's
+    context stay in that context, so they keep talking to the same instance
+    and database.
+    """
+
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_instances', {})
+        _locals.append(self)
+
+    def _instance(self):
+        tenant = current.get()
+        key = tenant.name if tenant is not None else None
+        instance = self._instances.get(key)
+        if instance is None:
+            instance = self._instances[key] = self._factory()
+        return instance
+
+    def __getattr__(self, name):
+        return getattr(self._instance(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._instance(), name, value)
+
+    def __contains__(self, item):
+        return item in self._instance()
+
+    def __len__(self):
+        return len(self._instance())
+
+    def instances(self) -> dict:
+        return dict(self._instances)
+
+
+def per_tenant(fn):
+    """Wrap a gauge's ``fn`` to report it for every tenant, as ``<tenant>:<label>``."""
+    def collect() -> dict:
+        if not registry:
+            return fn()
+        values = {}
+        for tenant in registry.values():
+            with use(tenant):
+                for label, value in fn().items():
+                    values[f"{tenant.name}:{label}"] = value
+        return values
+    return collect
+
+
+def _approx_size(obj, depth: int = 2) -> int:
+    size = sys.getsizeof(obj)
+    if depth == 0:
+        return size
+    if isinstance(obj, dict):
+        size += sum(_approx_size(k, depth - 1) + _approx_size(v, depth - 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_approx_size(item, depth - 1) for item in obj)
+    elif hasattr(obj, '__dict__') and not isinstance(obj, type):
+        size += _approx_size(vars(obj), depth)
+    return size
+
+
+def memory() -> dict:
+    """Approximate bytes held by each tenant's singletons."""
+    totals = {}
+    for local in _locals:
+        for key, instance in local.instances().items():
+            name = key or "default"
+            totals[name] = totals.get(name, 0) + _approx_size(instance)
+    return totals
+
+
+# --- Dispatch ---
+class TenantDispatcher(Dispatcher):
+    """Runs every update inside its bot's tenant context, and accounts for it."""
+
+    async def feed_update(self, bot: Bot, update, **kwargs):
+        tenant = registry.get(bot.id)
+        if tenant is None:
+            return await super().feed_update(bot, update, **kwargs)
+        started = time.perf_counter()
+        with use(tenant):
+            try:
+                return await super().feed_update(bot, update, **kwargs)
+            finally:
+                metrics.observe("tenant_update_seconds", tenant.name, time.perf_counter() - started)
+
+
+if registry:
+    metrics.gauge("tenant_memory_bytes", memory)
+    logging.info("Multi-tenant mode: %s", ", ".join(t.name for t in registry.values()))
@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# Modules live at the repository root; db.py opens DB_PATH on import
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(), "test.db"))
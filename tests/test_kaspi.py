@@ -0,0 +1,133 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import db
+import kaspi
+from ledger import PaymentPipeline
+from paid_users import paid_users
+
+
+class FakeMessage:
+    def __init__(self, user_id: int):
+        self.document = None
+        self.photo = [SimpleNamespace(file_id="receipt", file_size=1024)]
+        self.from_user = SimpleNamespace(id=user_id)
+        self.answers = []
+
+    async def answer(self, text, **kwargs):
+        self.answers.append(text)
+
+
+class FakeState:
+    async def clear(self):
+        pass
+
+
+class ReceiptTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.submitted = []
+        self.ledger = SimpleNamespace(submit=self.submitted.append)
+        recipient = mock.patch.object(kaspi, "KASPI_RECIPIENT", "ИП Тест")
+        recipient.start()
+        self.addCleanup(recipient.stop)
+
+    async def _send(self, sha256: str, user_id: int) -> FakeMessage:
+        fd, path = tempfile.mkstemp(dir=tempfile.gettempdir(), suffix=".jpg")
+        os.close(fd)
+
+        async def download(bot, file_id, suffix):
+            if sha256 is None:
+                raise OSError("connection reset")
+            return path, sha256
+
+        message = FakeMessage(user_id)
+        with mock.patch.object(kaspi, "_download", download), mock.patch.object(kaspi, "ledger", self.ledger):
+            await kaspi.receipt_handler(message, FakeState(), bot=None)
+        self.kept = os.path.exists(path)
+        if self.kept:
+            os.remove(path)
+        return message
+
+    async def test_receipt_is_credited_once(self):
+        await db.save_receipt_check("a" * 64, 101, True, kaspi.EXPECTED_AMOUNT, None)
+        first = await self._send("a" * 64, 101)
+        again = await self._send("a" * 64, 101)
+        self.assertEqual(len(self.submitted), 1)
+        self.assertIn("подтверждена", first.answers[-1])
+        self.assertIn("уже был использован", again.answers[-1])
+        # The verdict is stored, so the file is not kept
+        self.assertFalse(self.kept)
+
+    async def test_receipt_of_another_user_is_rejected(self):
+        await db.save_receipt_check("b" * 64, 201, True, kaspi.EXPECTED_AMOUNT, None)
+        message = await self._send("b" * 64, 202)
+        self.assertEqual(self.submitted, [])
+        self.assertIn("уже был использован", message.answers[-1])
+        # The owner can still use it
+        await self._send("b" * 64, 201)
+        self.assertEqual(len(self.submitted), 1)
+
+    async def test_failed_receipt_is_not_credited(self):
+        await db.save_receipt_check("c" * 64, 301, False, 1, "сумма не совпадает")
+        message = await self._send("c" * 64, 301)
+        self.assertEqual(self.submitted, [])
+        self.assertIn("не прошёл проверку", message.answers[-1])
+
+    async def test_failed_download_is_reported(self):
+        message = await self._send(None, 601)
+        self.assertEqual(self.submitted, [])
+        self.assertEqual(message.answers[-1], kaspi.UNREADABLE)
+
+    async def test_no_recipient_refuses_receipts(self):
+        await db.save_receipt_check("e" * 64, 501, True, kaspi.EXPECTED_AMOUNT, None)
+        with mock.patch.object(kaspi, "KASPI_RECIPIENT", ""):
+            message = await self._send("e" * 64, 501)
+        self.assertEqual(self.submitted, [])
+        self.assertEqual(message.answers, [kaspi.UNAVAILABLE])
+
+
+class LedgerTest(unittest.IsolatedAsyncioTestCase):
+    async def _commit(self, pipeline: PaymentPipeline, entry: tuple):
+        pipeline.submit(entry)
+        await pipeline._fill_batch()
+        await pipeline._commit()
+
+    async def test_replayed_payment_does_not_grant_access(self):
+        pipeline = PaymentPipeline(batch_delay=0)
+        entry = ("kaspi:" + "d" * 64, None, 401, kaspi.EXPECTED_AMOUNT * 100, "KZT", 30, "kaspi-receipt")
+        pipeline.submit(entry)
+        self.assertNotIn(401, paid_users)
+        await pipeline._fill_batch()
+        await pipeline._commit()
+        self.assertIn(401, paid_users)
+
+        # Subscription revoked, then the same charge comes in again
+        paid_users.discard(401)
+        await self._commit(pipeline, entry)
+        self.assertNotIn(401, paid_users)
+
+    async def test_bad_entry_is_dead_lettered(self):
+        pipeline = PaymentPipeline(batch_delay=0, max_attempts=1)
+        # A payload SQLite can't bind, so every commit of this batch fails
+        pipeline.submit(("bad-charge", None, 403, 100, "KZT", 30, {"order": 1}))
+        pipeline.submit(("good-charge", None, 402, 100, "KZT", 30, "card"))
+        await pipeline._fill_batch()
+        await pipeline._commit()
+        self.assertEqual(len(pipeline._batch), 2)
+        self.assertNotIn(402, paid_users)
+
+        # Past the limit the good entry goes through and the bad one is set aside
+        await pipeline._commit()
+        self.assertEqual(pipeline._batch, [])
+        self.assertIn(402, paid_users)
+        dead = await db.pool.run(
+            lambda conn: [row[0] for row in conn.execute("SELECT telegram_payment_charge_id FROM payment_dead_letters")]
+        )
+        self.assertEqual(dead, ["bad-charge"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+import time
+from collections import OrderedDict
+
+from aiogram import types as aio_types
+
+from roles import roles
+from metrics import metrics
+from tenants import TenantLocal, per_tenant
+
+# Tickets with no message from either side for this many seconds are closed
+IDLE_TIMEOUT = float(os.getenv("SUPPORT_TICKET_IDLE", 24 * 3600))
+
+
+class Ticket:
+    def __init__(self, user_id: int, curator_id: int):
+        self.user_id = user_id
+        self.curator_id = curator_id
+        self.opened_at = time.monotonic()
+        self.last_active = self.opened_at
+        # Set while the user waits for an answer, cleared by a curator reply
+        self.waiting_since = self.opened_at
+        self.message_ids = set()
+
+
+class TicketRouter:
+    """Open support tickets, indexed both ways.
+
+    New tickets go to the curator (a user in the ``support`` table) with the
+    fewest open tickets, ties broken round-robin. Forwarded message ids are
+    indexed so a curator's reply finds its user without touching the database.
+    Tickets left idle for ``idle_timeout`` are closed, so a forgotten one
+    doesn't keep taking the user's messages.
+    """
+
+    def __init__(self, idle_timeout: float = IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        # Least recently active first
+        self.by_user = OrderedDict()
+        self.by_curator = {}
+        # (curator_id, forwarded message_id) -> user_id
+        self.by_message = {}
+        self._next = 0
+
+    async def _pick_curator(self):
+        curators = sorted(await roles.support_ids())
+        if not curators:
+            return None
+        start = self._next % len(curators)
+        self._next += 1
+        rotated = curators[start:] + curators[:start]
+        return min(rotated, key=lambda c: len(self.by_curator.get(c, ())))
+
+    def _touch(self, ticket: Ticket):
+        if self.by_user.get(ticket.user_id) is ticket:
+            ticket.last_active = time.monotonic()
+            self.by_user.move_to_end(ticket.user_id)
+
+    def expire_idle(self):
+        """Close tickets idle for longer than ``idle_timeout``."""
+        deadline = time.monotonic() - self.idle_timeout
+        while self.by_user:
+            ticket = next(iter(self.by_user.values()))
+            if ticket.last_active > deadline:
+                break
+            self.close(ticket.user_id)
+            metrics.inc("support_tickets_expired_total", str(ticket.curator_id))
+
+    def active(self, user_id: int):
+        """The user's open ticket, or None."""
+        self.expire_idle()
+        return self.by_user.get(user_id)
+
+    async def open(self, user_id: int):
+        """Return the user's ticket, assigning a curator for a new one."""
+        ticket = self.active(user_id)
+        if ticket is not None and await roles.is_support(ticket.curator_id):
+            if ticket.waiting_since is None:
+                ticket.waiting_since = time.monotonic()
+            self._touch(ticket)
+            return ticket
+        if ticket is not None:
+            # Curator was removed from support, hand the ticket over
+            self.close(user_id)
+        curator_id = await self._pick_curator()
+        if curator_id is None:
+            return None
+        ticket = Ticket(user_id, curator_id)
+        self.by_user[user_id] = ticket
+        self.by_curator.setdefault(curator_id, set()).add(user_id)
+        return ticket
+
+    def track(self, ticket: Ticket, forwarded_message_id: int):
+        ticket.message_ids.add(forwarded_message_id)
+        self.by_message[(ticket.curator_id, forwarded_message_id)] = ticket.user_id
+
+    def reply_target(self, curator_id: int, replied_message_id: int):
+        user_id = self.by_message.get((curator_id, replied_message_id))
+        return self.by_user.get(user_id) if user_id is not None else None
+
+    def answered(self, ticket: Ticket):
+        self._touch(ticket)
+        if ticket.waiting_since is not None:
+            metrics.observe("support_response_seconds", str(ticket.curator_id),
+                            time.monotonic() - ticket.waiting_since)
+            ticket.waiting_since = None
+
+    def close(self, user_id: int):
+        ticket = self.by_user.pop(user_id, None)
+        if ticket is None:
+            return None
+        users = self.by_curator.get(ticket.curator_id)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self.by_curator[ticket.curator_id]
+        for message_id in ticket.message_ids:
+            self.by_message.pop((ticket.curator_id, message_id), None)
+        metrics.observe("support_ticket_seconds", str(ticket.curator_id), time.monotonic() - ticket.opened_at)
+        return ticket
+
+    def queue_depths(self) -> dict:
+        return {str(curator_id): len(users) for curator_id, users in self.by_curator.items()}
+
+    def reply_filter(self, message: aio_types.Message):
+        """aiogram filter: matches a curator's reply to a forwarded ticket message."""
+        if message.reply_to_message is None or message.from_user is None:
+            return False
+        ticket = self.reply_target(message.from_user.id, message.reply_to_message.message_id)
+        return {'ticket': ticket} if ticket is not None else False
+
+
+tickets = TenantLocal(TicketRouter)
+metrics.gauge("support_open_tickets", per_tenant(lambda: tickets.queue_depths()))
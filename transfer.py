@@ -0,0 +1,198 @@
+"""Bulk import and export of courses, users, payments and support.
+
+Files are CSV (with a header row) or JSONL, picked by extension. Exports
+stream rows from a cursor straight into the file; imports read the file in
+chunks of ``CHUNK_SIZE`` rows and insert them with ``executemany`` inside a
+single transaction, skipping (or for payments, merging) existing rows.
+
+Admins use ``/export <table> [csv|jsonl]`` and send a file captioned
+``/import <table>``. From the shell:
+
+    python transfer.py export users users.csv
+    python transfer.py import courses courses.jsonl
+"""
+import os
+import csv
+import sys
+import json
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram import types as aio_types
+
+import db
+from roles import roles
+from expiry import expiry
+
+CHUNK_SIZE = 5000
+FORMATS = ('csv', 'jsonl')
+MAX_IMPORT_SIZE = 20 * 1024 * 1024  # Bot API download limit
+
+
+def _format(path: str, fmt: str = None) -> str:
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"unsupported format {fmt!r}, use csv or jsonl")
+    return fmt
+
+
+def _writer(path: str, fmt: str):
+    def write(columns, rows) -> int:
+        count = 0
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            if fmt == 'csv':
+                out = csv.writer(f)
+                out.writerow(columns)
+                for row in rows:
+                    out.writerow(row)
+                    count += 1
+            else:
+                for row in rows:
+                    f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+                    f.write('\n')
+                    count += 1
+        return count
+    return write
+
+
+def _records(f, fmt: str):
+    if fmt == 'csv':
+        for record in csv.DictReader(f):
+            # CSV has no NULL; an empty cell means "not set"
+            yield {k: (v if v != '' else None) for k, v in record.items()}
+    else:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"line {number}: {e.msg}") from None
+            if not isinstance(record, dict):
+                raise ValueError(f"line {number}: expected an object, got {type(record).__name__}")
+            yield record
+
+
+def _read_chunks(path: str, fmt: str, columns):
+    """Yield lists of row tuples; rows without the key (first) column are skipped."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        chunk = []
+        for record in _records(f, fmt):
+            row = tuple(record.get(column) for column in columns)
+            if row[0] is None:
+                continue
+            chunk.append(row)
+            if len(chunk) >= CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+async def export_table(table: str, path: str, fmt: str = None) -> int:
+    """Write ``table`` to ``path`` and return the number of rows."""
+    return await db.export_table(table, _writer(path, _format(path, fmt)))
+
+
+async def import_file(table: str, path: str, fmt: str = None) -> int:
+    """Load ``path`` into ``table`` and return the number of rows changed."""
+    columns = db.TRANSFER_TABLES[table][1]
+    # The generator is consumed on the writer thread, file reads included
+    return await db.import_rows(table, _read_chunks(path, _format(path, fmt), columns))
+
+
+# --- Admin commands ---
+def _usage(command: str) -> str:
+    tables = ", ".join(db.TRANSFER_TABLES)
+    if command == "export":
+        return f"Использование: /export <таблица> [csv|jsonl]\nТаблицы: {tables}"
+    return f"Отправьте файл .csv или .jsonl с подписью /import <таблица>\nТаблицы: {tables}"
+
+
+async def export_handler(message: aio_types.Message, bot: Bot):
+    if not await roles.is_admin(message.from_user.id):
+        return
+    parts = message.text.split()[1:]
+    if not parts or parts[0] not in db.TRANSFER_TABLES or (len(parts) > 1 and parts[1] not in FORMATS):
+        await message.answer(_usage("export"))
+        return
+    table, fmt = parts[0], parts[1] if len(parts) > 1 else 'csv'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = f"{table}-{datetime.now():%Y%m%d-%H%M}.{fmt}"
+        path = os.path.join(tmp, filename)
+        count = await export_table(table, path, fmt)
+        await bot.send_document(
+            message.chat.id,
+            aio_types.FSInputFile(path, filename=filename),
+            caption=f"📦 {table}: {count} строк"
+        )
+
+
+async def import_handler(message: aio_types.Message, bot: Bot):
+    if not await roles.is_admin(message.from_user.id):
+        return
+    parts = (message.text or message.caption).split()[1:]
+    # The file can come with the command or be the message it replies to
+    document = message.document or (message.reply_to_message and message.reply_to_message.document)
+    if not parts or parts[0] not in db.TRANSFER_TABLES or document is None:
+        await message.answer(_usage("import"))
+        return
+    table = parts[0]
+    try:
+        fmt = _format(document.file_name or "")
+    except ValueError:
+        await message.answer(_usage("import"))
+        return
+    if (document.file_size or 0) > MAX_IMPORT_SIZE:
+        await message.answer("🚫 Файл больше 20 МБ, загрузите его через python transfer.py import.")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"import.{fmt}")
+        await bot.download(document, destination=path)
+        try:
+            changed = await import_file(table, path, fmt)
+        except (ValueError, UnicodeDecodeError, csv.Error, sqlite3.Error) as e:
+            await message.answer(f"🚫 Не удалось прочитать файл: {e}")
+            return
+
+    if table == 'payments':
+        # Imported subscriptions take effect right away
+        await db.warm_paid_users()
+        expiry.reload()
+    await message.answer(f"✅ {table}: добавлено или обновлено {changed} строк.")
+
+
+# --- CLI ---
+def main():
+    parser = argparse.ArgumentParser(description="Import or export bot tables as CSV/JSONL.")
+    parser.add_argument("action", choices=("import", "export"))
+    parser.add_argument("table", choices=tuple(db.TRANSFER_TABLES))
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            if args.action == "export":
+                count = await export_table(args.table, args.path, args.format)
+                print(f"{args.table}: exported {count} rows to {args.path}")
+            else:
+                changed = await import_file(args.table, args.path, args.format)
+                print(f"{args.table}: {changed} rows inserted or updated")
+        finally:
+            db.pool.close()
+
+    try:
+        asyncio.run(run())
+    except (ValueError, OSError, sqlite3.Error) as e:
+        sys.exit(f"error: {e}")
+
+
+if __name__ == "__main__":
+    main()
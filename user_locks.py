@@ -0,0 +1,104 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from aiogram import BaseMiddleware
+
+from metrics import metrics
+
+# Identical button presses (same user, message and data) this close together are dropped
+DEBOUNCE_SECONDS = float(os.getenv("CALLBACK_DEBOUNCE", 1.0))
+# Upper bound on remembered presses; entries older than the window go first anyway
+DEBOUNCE_SIZE = 10000
+
+
+class KeyedLocks:
+    """One ``asyncio.Lock`` per key, alive only while someone holds or waits on it.
+
+    Each entry counts its users and is removed by the last one out, so the
+    table is as large as the number of keys in use right now.
+    """
+
+    def __init__(self):
+        # key -> [lock, users]
+        self._locks = {}
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class UserSerializer(BaseMiddleware):
+    """Outer update middleware: one update at a time per user.
+
+    A double-tapped button would otherwise run its handler twice at once,
+    editing the same message twice or sending two invoices. Callback queries
+    are also answered right away, so the client spinner stops before the
+    handler does any work; handlers must not answer them again.
+    """
+
+    def __init__(self, debounce: float = DEBOUNCE_SECONDS):
+        self.debounce = debounce
+        self.locks = KeyedLocks()
+        # (bot id, user id, message id, data) -> time of the last press
+        self._presses = OrderedDict()
+        self._answers = set()
+
+    async def _send_answer(self, query):
+        try:
+            await query.answer()
+        except Exception as e:
+            logging.warning("Could not answer callback query: %s", e)
+
+    def _answer(self, query):
+        # Sent alongside the handler rather than before it
+        task = asyncio.create_task(self._send_answer(query))
+        self._answers.add(task)
+        task.add_done_callback(self._answers.discard)
+
+    def _repeated(self, key) -> bool:
+        now = time.monotonic()
+        while self._presses:
+            oldest, pressed = next(iter(self._presses.items()))
+            if now - pressed < self.debounce and len(self._presses) < DEBOUNCE_SIZE:
+                break
+            del self._presses[oldest]
+        if key in self._presses:
+            return True
+        self._presses[key] = now
+        return False
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+        bot_id = data['bot'].id
+        query = event.callback_query
+        if query is not None:
+            self._answer(query)
+            message_id = query.message.message_id if query.message else query.inline_message_id
+            if self.debounce > 0 and self._repeated((bot_id, user.id, message_id, query.data)):
+                metrics.inc("bot_updates_debounced_total", (query.data or "").partition(':')[0])
+                return None
+        async with self.locks.hold((bot_id, user.id)):
+            return await handler(event, data)
+
+
+user_serializer = UserSerializer()
+metrics.gauge("user_locks", lambda: {'held': len(user_serializer.locks)})
@@ -0,0 +1,92 @@
+import os
+import signal
+import asyncio
+import logging
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from dotenv import load_dotenv
+
+# --- Load environment variables from .env ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(os.path.join(BASE_DIR, '.env'))
+
+# --- Configuration ---
+# Public base URL Telegram should call, e.g. https://bot.example.com.
+# Leave empty to serve locally without registering the webhook.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Required: without it anyone who finds the path could post forged updates
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+# How long shutdown waits for updates that were acknowledged but not yet handled
+DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", 10))
+
+
+class DrainingRequestHandler(SimpleRequestHandler):
+    """Acknowledges updates with 200 immediately and handles them in the
+    background; on shutdown waits for in-flight updates before closing."""
+
+    async def close(self) -> None:
+        tasks = set(self._background_feed_update_tasks)
+        if tasks:
+            logging.info("Waiting for %d in-flight updates", len(tasks))
+            await asyncio.wait(tasks, timeout=DRAIN_TIMEOUT)
+        await super().close()
+
+
+def webhook_paths(bots: dict) -> "dict[str, Bot]":
+    """Path each bot is served on: ``WEBHOOK_PATH`` alone, or
+    ``WEBHOOK_PATH/<tenant>`` for every tenant in multi-tenant mode."""
+    return {
+        WEBHOOK_PATH if tenant is None else f"{WEBHOOK_PATH}/{tenant.name}": bot
+        for tenant, bot in bots.items()
+    }
+
+
+def build_app(dp: Dispatcher, paths: "dict[str, Bot]") -> web.Application:
+    app = web.Application()
+    for path, bot in paths.items():
+        DrainingRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            secret_token=WEBHOOK_SECRET,
+            handle_in_background=True
+        ).register(app, path=path)
+    setup_application(app, dp, bots=list(paths.values()))
+    return app
+
+
+async def serve(dp: Dispatcher, bots: dict):
+    """Serve ``bots`` (tenant -> Bot, see main.py) until SIGINT/SIGTERM."""
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET must be set in webhook mode")
+    paths = webhook_paths(bots)
+    runner = web.AppRunner(build_app(dp, paths))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logging.info("Webhook server listening on %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, ", ".join(paths))
+
+    if WEBHOOK_URL:
+        for path, bot in paths.items():
+            await bot.set_webhook(
+                WEBHOOK_URL.rstrip('/') + path,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types()
+            )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    try:
+        await stop.wait()
+    finally:
+        # Stops accepting requests, then runs the drain in DrainingRequestHandler.close
+        await runner.cleanup()